@@ -0,0 +1,67 @@
+import re
+import unicodedata
+
+from django.conf import settings
+
+# Text is normalized the same way when it is indexed and when it is searched,
+# so spellings that differ only in ways readers ignore still match: case and
+# Latin accents, and in Arabic the diacritics (tashkeel), tatweel, the hamza
+# forms of alef, waw and yaa, taa marbuta and alef maqsura. With
+# SEARCH_ARABIC_STEMMING, Arabic words also lose their common prefixes and
+# suffixes (light stemming). Changing any of this requires running
+# rebuild_search_index.
+
+TATWEEL = 'ـ'
+ARABIC_LETTERS = str.maketrans({
+    'ٱ': 'ا',  # Alef wasla to alef
+    'ى': 'ي',  # Alef maqsura to yaa
+    'ة': 'ه',  # Taa marbuta to haa
+    # Arabic-Indic and Persian digits
+    **{chr(0x0660 + i): str(i) for i in range(10)},
+    **{chr(0x06f0 + i): str(i) for i in range(10)},
+})
+ARABIC_WORD = re.compile('[\u0621-\u064a]+')
+WORD = re.compile(r'\w+')
+# A word of unnormalized text, with the diacritics and tatweel inside it
+SOURCE_WORD = re.compile(r'(?:\w|[\u0300-\u036f\u0610-\u061a\u0640\u064b-\u065f\u0670\u06d6-\u06ed])+')
+
+# Light stemming after Larkey et al. (light10), applied to normalized words.
+# Longest affixes first; a stem keeps at least MIN_STEM letters.
+PREFIXES = ('وال', 'بال', 'كال', 'فال', 'لل', 'ال', 'و')
+SUFFIXES = ('ها', 'ان', 'ات', 'ون', 'ين', 'يه', 'ه', 'ي')
+MIN_STEM = 3
+
+
+def normalize(text):
+    """Case-folded text without accents, diacritics or letter variants."""
+    # NFKD splits accented Latin letters, and alef, waw and yaa with hamza or
+    # madda, into a base letter and a nonspacing mark; tashkeel are such marks
+    text = unicodedata.normalize('NFKD', text.casefold())
+    text = ''.join(char for char in text if unicodedata.category(char) != 'Mn')
+    return text.replace(TATWEEL, '').translate(ARABIC_LETTERS)
+
+
+def light_stem(word):
+    if not ARABIC_WORD.fullmatch(word):
+        return word
+    for prefix in PREFIXES:
+        if word.startswith(prefix) and len(word) - len(prefix) >= MIN_STEM:
+            word = word[len(prefix):]
+            break
+    for suffix in SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= MIN_STEM:
+            word = word[:-len(suffix)]
+    return word
+
+
+def tokenize(text):
+    """Normalized (and, with SEARCH_ARABIC_STEMMING, stemmed) words of ``text``."""
+    words = WORD.findall(normalize(text))
+    if settings.SEARCH_ARABIC_STEMMING:
+        words = [light_stem(word) for word in words]
+    return words
+
+
+def analyze(text):
+    """``text`` as stored in the search index: its tokens joined by spaces."""
+    return ' '.join(tokenize(text))
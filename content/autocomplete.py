@@ -0,0 +1,145 @@
+import threading
+from bisect import bisect_left, insort
+
+from django.urls import reverse
+
+from core.versions import get_version
+from .analysis import WORD, normalize
+from .models import Lesson, Resource, Test
+
+# Version counter bumped after every commit that changes the search index
+SEARCH_VERSION = 'search'
+
+
+def title_keys(title):
+    """
+    Normalized keys a title is found under: the whole title and the rest of
+    it from each later word on, so typing any word of a title finds it. Each
+    key ends with a space, like a query whose last word is complete.
+    """
+    words = WORD.findall(normalize(title))
+    return [' '.join(words[i:]) + ' ' for i in range(len(words))]
+
+
+def query_key(query):
+    words = WORD.findall(normalize(query))
+    key = ' '.join(words)
+    # A trailing space means the last word is complete
+    return key + ' ' if key and query[-1:].isspace() else key
+
+
+class TitleIndex:
+    """
+    Sorted arrays of the title keys of approved lessons, tests and resources,
+    searched by prefix with bisect: one of whole titles, so titles starting
+    with the query are always found, and one of every key.
+
+    The index is local to the process. It is stamped with the shared
+    ``SEARCH_VERSION`` counter: changes committed by this process are applied
+    in place when the index was current, and any other change makes the next
+    lookup reload every title (three queries).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._starts = []
+        self._keys = []
+        self._items = {}
+        self._stamp = None
+        self._generation = 0
+
+    def lookup(self, query, limit):
+        """Up to ``limit`` ``(kind, id, title)`` items, titles starting with the query first."""
+        key = query_key(query)
+        if not key:
+            return []
+        stamp = get_version(SEARCH_VERSION)
+        with self._lock:
+            current = self._stamp == stamp
+            generation = self._generation
+        if not current:
+            self._fill(self._load(), stamp, generation)
+
+        with self._lock:
+            matches = []
+            seen = set()
+            # Matching keys are contiguous from the insertion point; look at a
+            # bounded number of them so one-letter queries stay cheap. Whole
+            # titles are searched first, so enough of them are always found.
+            for keys, bound in ((self._starts, limit), (self._keys, limit * 10)):
+                found = 0
+                for index in range(bisect_left(keys, (key,)), len(keys)):
+                    entry_key, position, item = keys[index]
+                    if not entry_key.startswith(key) or found >= bound:
+                        break
+                    found += 1
+                    if item not in seen:
+                        seen.add(item)
+                        matches.append((position, self._items[item], item))
+        matches.sort()
+        return [(kind, pk, title) for _, title, (kind, pk) in matches[:limit]]
+
+    def _load(self):
+        items = {}
+        for kind, model in (('lesson', Lesson), ('test', Test), ('resource', Resource)):
+            for pk, title in model.objects.filter(is_approved=True, is_removed=False).values_list('id', 'title'):
+                items[(kind, pk)] = title
+        return items
+
+    def _fill(self, items, stamp, generation):
+        keys = sorted(
+            (key, position, item)
+            for item, title in items.items()
+            for position, key in enumerate(title_keys(title))
+        )
+        with self._lock:
+            # A change applied meanwhile may be missing from what was loaded
+            if self._generation != generation:
+                return
+            self._starts = [entry for entry in keys if entry[1] == 0]
+            self._keys = keys
+            self._items = items
+            self._stamp = stamp
+
+    def change(self, changes, stamp):
+        """
+        Apply ``(kind, id, title)`` changes committed as version ``stamp``; a
+        None title removes the item.
+        """
+        with self._lock:
+            self._generation += 1
+            if self._stamp is None or self._stamp != stamp - 1:
+                # Other changes happened in between; reload on the next lookup
+                self._stamp = None
+                return
+            for kind, pk, title in changes:
+                item = (kind, pk)
+                if self._items.pop(item, None) is not None:
+                    self._starts = [entry for entry in self._starts if entry[2] != item]
+                    self._keys = [entry for entry in self._keys if entry[2] != item]
+                if title is not None:
+                    self._items[item] = title
+                    for position, key in enumerate(title_keys(title)):
+                        if position == 0:
+                            insort(self._starts, (key, position, item))
+                        insort(self._keys, (key, position, item))
+            self._stamp = stamp
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._starts = []
+            self._keys = []
+            self._items = {}
+            self._stamp = None
+
+
+title_index = TitleIndex()
+
+
+def item_url(kind, pk):
+    if kind == 'lesson':
+        return reverse('lesson_detail', args=[pk])
+    if kind == 'test':
+        return reverse('test_detail', args=[pk])
+    return reverse('resource_list')
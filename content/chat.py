@@ -0,0 +1,452 @@
+import asyncio
+import binascii
+import json
+import threading
+import zlib
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import deque
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import router
+
+from core.versions import get_version
+from .models import ChatMessage, ChatChange, ChatArchive
+
+
+class ChatBroker:
+    """
+    In-process pub/sub for chat rooms.
+
+    Every room, keyed by ``(year, stream)``, has a version number that is bumped
+    whenever one of its messages is written. Waiters remember the version they
+    last saw and are woken as soon as it changes. The broker only lives in the
+    current process, so streaming clients still re-check the database on every
+    keepalive tick to pick up writes made by other workers.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._versions = {}
+        self._waiters = {}
+
+    def version(self, room):
+        with self._lock:
+            return self._versions.get(room, 0)
+
+    def publish(self, room):
+        with self._lock:
+            self._versions[room] = self._versions.get(room, 0) + 1
+            waiters = self._waiters.pop(room, set())
+        for loop, future in waiters:
+            try:
+                loop.call_soon_threadsafe(_resolve, future)
+            except RuntimeError:
+                # The waiter's event loop has already been closed.
+                pass
+
+    async def wait(self, room, since, timeout):
+        """
+        Wait until the room version differs from ``since``.
+        Returns False if the timeout expired without any change.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        waiter = (loop, future)
+        with self._lock:
+            if self._versions.get(room, 0) != since:
+                return True
+            self._waiters.setdefault(room, set()).add(waiter)
+        try:
+            await asyncio.wait_for(future, timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            with self._lock:
+                room_waiters = self._waiters.get(room)
+                if room_waiters is not None:
+                    room_waiters.discard(waiter)
+                    if not room_waiters:
+                        del self._waiters[room]
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(True)
+
+
+chat_broker = ChatBroker()
+
+
+class RecentMessages:
+    """
+    Bounded per-room ring buffer of the latest visible messages of each room.
+
+    Entries are serialized once, when the message is written or when a cold room
+    is loaded from the database, and shared by every reader of the room. Writes
+    append to the buffer; edits and removals invalidate the room so the next
+    read reloads it. Each room also remembers the latest change version
+    (``ChatChange`` id) its entries reflect, so clients can sync from there.
+
+    The buffer is local to the process. To notice writes made by other
+    workers, each room is stamped with the room's shared write counter (see
+    ``room_version_name``) and treated as cold once the counter moves on.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._lock = threading.Lock()
+        self._rooms = {}
+        self._generations = {}
+
+    def get(self, room, stamp):
+        """
+        Return ``(entries, complete, version)`` for a room warm at write counter
+        ``stamp``, or None when it is cold or stale.
+        """
+        with self._lock:
+            buffer = self._rooms.get(room)
+            if buffer is None or buffer[3] != stamp:
+                return None
+            entries, complete, version, _ = buffer
+            return list(entries), complete, version
+
+    def generation(self, room):
+        with self._lock:
+            return self._generations.get(room, 0)
+
+    def fill(self, room, entries, complete, version, stamp, generation):
+        """
+        Store entries loaded from the database, unless the room was written to
+        since ``generation`` was read (the load may have missed that write).
+        """
+        with self._lock:
+            if self._generations.get(room, 0) != generation:
+                return
+            self._rooms[room] = (deque(entries, maxlen=self.size), complete, version, stamp)
+
+    def append(self, room, entry, version, stamp):
+        with self._lock:
+            self._generations[room] = self._generations.get(room, 0) + 1
+            buffer = self._rooms.get(room)
+            if buffer is None:
+                return
+            entries, complete, current_version, _ = buffer
+            if version <= current_version or (entries and entries[-1]['id'] >= entry['id']):
+                # Out of order commit; let the next read reload the room
+                del self._rooms[room]
+                return
+            if len(entries) == entries.maxlen:
+                complete = False
+            entries.append(entry)
+            self._rooms[room] = (entries, complete, version, stamp)
+
+    def invalidate(self, room):
+        with self._lock:
+            self._generations[room] = self._generations.get(room, 0) + 1
+            self._rooms.pop(room, None)
+
+    def clear(self):
+        with self._lock:
+            for room in self._rooms:
+                self._generations[room] = self._generations.get(room, 0) + 1
+            self._rooms.clear()
+
+
+recent_messages = RecentMessages(max(settings.CHAT_BUFFER_SIZE, settings.CHAT_PAGE_SIZE))
+
+
+def room_version_name(year, stream):
+    """Name of the shared counter bumped after every write to a room."""
+    return f'chat:{year}:{stream}'
+
+
+def can_access_room(user, year, stream):
+    return user.is_teacher or user.is_staff or (user.year == year and user.stream == stream)
+
+
+# Columns the chat read path projects, and the author's display fields
+MESSAGE_COLUMNS = ('id', 'author_id', 'message', 'created_at')
+AUTHOR_FIELDS = ('nickname', 'real_name', 'username')
+MESSAGE_FIELDS = MESSAGE_COLUMNS + tuple(f'author__{field}' for field in AUTHOR_FIELDS)
+
+
+def message_rows(queryset, *extra):
+    """
+    Evaluate a ChatMessage queryset into ``MESSAGE_FIELDS`` rows, plus any
+    ``extra`` columns. The author fields are joined in, or read with one more
+    query when chat lives in its own database (see ``content.routers``).
+    """
+    User = get_user_model()
+    if router.db_for_read(ChatMessage) == router.db_for_read(User):
+        return list(queryset.values(*extra, *MESSAGE_FIELDS))
+
+    rows = list(queryset.values(*extra, *MESSAGE_COLUMNS))
+    authors = {
+        author['id']: author
+        for author in User.objects.filter(pk__in={row['author_id'] for row in rows}).values('id', *AUTHOR_FIELDS)
+    }
+    for row in rows:
+        author = authors.get(row['author_id'], {})
+        for field in AUTHOR_FIELDS:
+            row[f'author__{field}'] = author.get(field)
+    return rows
+
+
+def _entry(msg_id, author_id, author, text, created_at):
+    return {
+        'id': msg_id,
+        'author_id': author_id,
+        'author': author,
+        'text': text,
+        'created_at': created_at,
+        'time': created_at.strftime('%b %d, %H:%M')
+    }
+
+
+def message_entry(msg):
+    """User-independent serialization of a message, as kept in the buffer."""
+    author = msg.author.nickname or msg.author.real_name or msg.author.username
+    return _entry(msg.id, msg.author_id, author, msg.message, msg.created_at)
+
+
+def row_entry(row):
+    """Same as message_entry, for a ``MESSAGE_FIELDS`` values() row."""
+    author = row['author__nickname'] or row['author__real_name'] or row['author__username']
+    return _entry(row['id'], row['author_id'], author, row['message'], row['created_at'])
+
+
+def present_entry(entry, user):
+    return {
+        'id': entry['id'],
+        'author': entry['author'],
+        'is_mine': entry['author_id'] == user.pk,
+        'text': entry['text'],
+        'time': entry['time']
+    }
+
+
+def serialize_message(msg, user):
+    return present_entry(message_entry(msg), user)
+
+
+def room_entries(year, stream):
+    """
+    Return ``(entries, complete, version)`` for the latest messages of a room,
+    loading the buffer from the database on a cold start. ``complete`` means
+    the buffer holds every visible message of the room, and ``version`` is the
+    room change version the entries are current with.
+    """
+    room = (year, stream)
+    stamp = get_version(room_version_name(year, stream))
+    cached = recent_messages.get(room, stamp)
+    if cached is not None:
+        return cached
+
+    generation = recent_messages.generation(room)
+    # Read the version before the messages so the snapshot is at least that fresh
+    version = room_version(year, stream)
+    latest = ChatMessage.objects.filter(
+        year=year, stream=stream, is_removed=False
+    ).order_by('-id')[:recent_messages.size]
+    entries = [row_entry(row) for row in reversed(message_rows(latest))]
+    complete = len(entries) < recent_messages.size
+    recent_messages.fill(room, entries, complete, version, stamp, generation)
+    return entries, complete, version
+
+
+def fetch_entries(user, year, stream, last_id=None):
+    """
+    Return ``(entries, version)``: the buffer entries of a room newer than
+    ``last_id``, or the latest ``CHAT_PAGE_SIZE`` entries when no ``last_id``
+    is given, and the change version they are current with. Served from the
+    room buffer; the database is only read on a cold start or when ``last_id``
+    is older than the buffer, and then at most ``CHAT_HISTORY_MAX_PAGE``
+    entries are returned.
+    """
+    entries, complete, version = room_entries(year, stream)
+
+    if last_id and str(last_id).isdigit():
+        last_id = int(last_id)
+        if complete or (entries and entries[0]['id'] <= last_id):
+            entries = [entry for entry in entries if entry['id'] > last_id]
+        else:
+            older = ChatMessage.objects.filter(
+                year=year, stream=stream, is_removed=False, id__gt=last_id
+            ).order_by('id')[:settings.CHAT_HISTORY_MAX_PAGE]
+            entries = [row_entry(row) for row in message_rows(older)]
+    else:
+        entries = entries[-settings.CHAT_PAGE_SIZE:]
+
+    if user.last_chat_clear_time:
+        entries = [entry for entry in entries if entry['created_at'] > user.last_chat_clear_time]
+
+    return entries, version
+
+
+def room_version(year, stream):
+    latest = ChatChange.objects.filter(year=year, stream=stream).order_by('-id').values_list('id', flat=True).first()
+    return latest or 0
+
+
+def fetch_changes(user, year, stream, since):
+    """
+    Compact delta of a room since change version ``since``: messages created,
+    edited and removed after it, each reported once in its current state.
+    At most ``CHAT_CHANGES_MAX`` changes are folded into one delta; ``has_more``
+    tells the client to ask again from the returned ``version``.
+    """
+    changes = list(
+        ChatChange.objects.filter(year=year, stream=stream, id__gt=since)
+        .order_by('id').values_list('id', 'message_id', 'kind')[:settings.CHAT_CHANGES_MAX]
+    )
+    delta = {
+        'version': changes[-1][0] if changes else since,
+        'messages': [],
+        'edited': [],
+        'removed': [],
+        'has_more': len(changes) == settings.CHAT_CHANGES_MAX
+    }
+    if not changes:
+        return delta
+
+    created = {message_id for _, message_id, kind in changes if kind == ChatChange.CREATE}
+    message_ids = {message_id for _, message_id, _ in changes}
+    current = {
+        row['id']: row
+        for row in message_rows(ChatMessage.objects.filter(id__in=message_ids), 'is_removed')
+    }
+
+    for message_id in sorted(message_ids):
+        row = current.get(message_id)
+        if row is None or row['is_removed']:
+            delta['removed'].append(message_id)
+            continue
+        if user.last_chat_clear_time and row['created_at'] <= user.last_chat_clear_time:
+            continue
+        key = 'messages' if message_id in created else 'edited'
+        delta[key].append(present_entry(row_entry(row), user))
+    return delta
+
+
+def encode_cursor(entry):
+    raw = f"{entry['id']}|{entry['created_at'].isoformat()}"
+    return urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return ``(id, created_at)`` for a cursor; raises ValueError if it is malformed."""
+    try:
+        raw = urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        msg_id, created_at = raw.split('|', 1)
+        return int(msg_id), datetime.fromisoformat(created_at)
+    except (TypeError, UnicodeDecodeError, binascii.Error) as e:
+        raise ValueError('Invalid cursor') from e
+
+
+def archive_month(created_at):
+    """First day of the (UTC) month a message is archived under."""
+    return created_at.astimezone(dt_timezone.utc).date().replace(day=1)
+
+
+def pack_entries(entries):
+    return zlib.compress(json.dumps([
+        [entry['id'], entry['author_id'], entry['author'], entry['text'], entry['created_at'].isoformat()]
+        for entry in entries
+    ]).encode())
+
+
+def unpack_entries(data):
+    return [
+        _entry(msg_id, author_id, author, text, datetime.fromisoformat(created_at))
+        for msg_id, author_id, author, text, created_at in json.loads(zlib.decompress(data))
+    ]
+
+
+def archived_entries(user, year, stream, limit, before=None, after=None):
+    """
+    Up to ``limit`` archived entries of a room visible to ``user``, oldest
+    first: the newest ones before the ``(created_at, id)`` key ``before``, or
+    the oldest ones after ``after``. Archives are decompressed a month at a
+    time and only as far back (or forward) as the page needs.
+    """
+    archives = ChatArchive.objects.filter(year=year, stream=stream)
+    if after:
+        archives = archives.filter(month__gte=archive_month(after[0])).order_by('month')
+    else:
+        if before:
+            archives = archives.filter(month__lte=archive_month(before[0]))
+        archives = archives.order_by('-month')
+
+    found = []
+    for data in archives.values_list('data', flat=True).iterator(chunk_size=1):
+        entries = unpack_entries(data)
+        if not after:
+            entries.reverse()
+        for entry in entries:
+            key = (entry['created_at'], entry['id'])
+            if (before and key >= before) or (after and key <= after):
+                continue
+            if user.last_chat_clear_time and entry['created_at'] <= user.last_chat_clear_time:
+                continue
+            found.append(entry)
+            if len(found) == limit:
+                break
+        if len(found) == limit:
+            break
+
+    if not after:
+        found.reverse()
+    return found
+
+
+def fetch_history(user, year, stream, before=None, after=None, limit=None):
+    """
+    Keyset-paginated page of a room's history, oldest first.
+
+    Pages are walked along ``(created_at, id)`` so every page is a range scan
+    of the ``(year, stream, created_at)`` index, however deep the scrollback.
+    Past the oldest message still in the table, pages continue into the
+    room's archives (see ``archived_entries``).
+    Returns ``(entries, before_cursor, after_cursor)``; ``before_cursor`` is
+    None once the start of the room is reached.
+    """
+    limit = min(max(limit or settings.CHAT_PAGE_SIZE, 1), settings.CHAT_HISTORY_MAX_PAGE)
+    query = ChatMessage.objects.filter(year=year, stream=stream, is_removed=False)
+    if user.last_chat_clear_time:
+        query = query.filter(created_at__gt=user.last_chat_clear_time)
+
+    if after:
+        after_id, after_time = decode_cursor(after)
+        # Archived messages are older than every message left in the table
+        entries = archived_entries(user, year, stream, limit, after=(after_time, after_id))
+        if len(entries) < limit:
+            query = query.filter(created_at__gte=after_time).exclude(created_at=after_time, id__lte=after_id)
+            rows = message_rows(query.order_by('created_at', 'id')[:limit - len(entries)])
+            entries += [row_entry(row) for row in rows]
+        has_older = True
+    else:
+        bound = None
+        if before:
+            before_id, before_time = decode_cursor(before)
+            bound = (before_time, before_id)
+            query = query.filter(created_at__lte=before_time).exclude(created_at=before_time, id__gte=before_id)
+        entries = [row_entry(row) for row in message_rows(query.order_by('-created_at', '-id')[:limit + 1])]
+        if len(entries) <= limit:
+            # The table holds no older messages; carry on into the archives
+            if entries:
+                bound = (entries[-1]['created_at'], entries[-1]['id'])
+            entries += reversed(archived_entries(user, year, stream, limit + 1 - len(entries), before=bound))
+        has_older = len(entries) > limit
+        entries = entries[:limit]
+        entries.reverse()
+
+    if not entries:
+        return entries, None, after
+    return (
+        entries,
+        encode_cursor(entries[0]) if has_older else None,
+        encode_cursor(entries[-1])
+    )
@@ -0,0 +1,9 @@
+from .notifications import cached_unread_notification_count
+
+
+def notifications(request):
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        return {}
+    # A callable, so the count is only looked up by templates that show it
+    return {'unread_notification_count': lambda: cached_unread_notification_count(user)}
@@ -0,0 +1,57 @@
+import hashlib
+import logging
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Text of uploaded PDFs is extracted by the extract_attachment_text job, never during
+# the upload request. Files are read in chunks to hash them and page by page
+# to extract them, so memory stays bounded whatever their size. Extraction
+# needs pypdf (see requirements.txt); without it PDFs are simply not indexed.
+
+
+def attached_file(item):
+    """The file field of a lesson, test or resource."""
+    return item.file if hasattr(item, 'file') else item.pdf_file
+
+
+def is_pdf(file):
+    return bool(file) and file.name.lower().endswith('.pdf')
+
+
+def file_digest(file):
+    digest = hashlib.sha256()
+    with file.open('rb'):
+        for chunk in file.chunks():
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def extract_pdf_text(file):
+    """
+    Return ``(text, page_count)`` for a PDF, reading one page at a time and
+    stopping after SEARCH_PDF_MAX_PAGES pages or SEARCH_PDF_MAX_CHARS
+    characters. Raises ImportError without pypdf; the text of malformed files
+    ends where parsing failed.
+    """
+    from pypdf import PdfReader
+
+    parts = []
+    size = 0
+    page_count = 0
+    with file.open('rb'):
+        try:
+            reader = PdfReader(file)
+            for page in reader.pages:
+                if page_count >= settings.SEARCH_PDF_MAX_PAGES or size >= settings.SEARCH_PDF_MAX_CHARS:
+                    break
+                text = page.extract_text() or ''
+                parts.append(text[:settings.SEARCH_PDF_MAX_CHARS - size])
+                size += len(parts[-1])
+                page_count += 1
+        except Exception as e:
+            # Malformed files raise all kinds of errors from inside the
+            # parser, and retrying won't fix them; index what was read
+            logger.warning('Could not read %s: %r', file.name, e)
+    return '\n'.join(parts), page_count
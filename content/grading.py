@@ -0,0 +1,67 @@
+from django.core.cache import cache
+from django.db import transaction
+
+from core.versions import get_version
+from .models import Question, Result, StudentAnswer
+
+# A submission is graded in one pass over the questions already loaded to
+# render or validate the test, and stored with two inserts: the result, then
+# every answer at once.
+#
+# A test's questions and answer key are cached under the test's question
+# counter, which is bumped whenever one of its questions is added, edited or
+# removed, so students taking the same test don't each read them again.
+
+OPTIONS = {value for value, label in Question._meta.get_field('correct_option').choices}
+
+QUESTION_FIELDS = ('id', 'text', 'option_a', 'option_b', 'option_c', 'option_d', 'correct_option')
+QUESTIONS_TIMEOUT = 24 * 60 * 60
+
+
+def question_version_name(test_id):
+    """Name of the counter bumped after every write to a test's questions."""
+    return f'questions:{test_id}'
+
+
+def question_set(test):
+    """The test's questions, with their answer key, from the cache when they haven't changed."""
+    key = f'test-questions:{test.pk}:{get_version(question_version_name(test.pk))}'
+    rows = cache.get(key)
+    if rows is None:
+        rows = list(test.questions.filter(is_removed=False).order_by('id').values(*QUESTION_FIELDS))
+        cache.set(key, rows, QUESTIONS_TIMEOUT)
+    # Plain field values are cached rather than pickled model instances
+    return [Question(test=test, **row) for row in rows]
+
+
+def submitted_answers(questions, data):
+    """``{question_id: option}`` submitted in ``data``; unanswered questions map to None."""
+    answers = {}
+    for question in questions:
+        option = data.get(f'question_{question.id}')
+        answers[question.id] = option if option in OPTIONS else None
+    return answers
+
+
+def grade(questions, answers):
+    """The score and the unsaved StudentAnswer rows of ``answers``, against the questions' key."""
+    rows = [
+        StudentAnswer(
+            question_id=question.id,
+            selected_option=answers[question.id],
+            is_correct=answers[question.id] == question.correct_option,
+        )
+        for question in questions
+    ]
+    return sum(row.is_correct for row in rows), rows
+
+
+def record_result(student, test, questions, answers):
+    """Grade a complete submission and save its Result and answers together."""
+    score, rows = grade(questions, answers)
+    with transaction.atomic():
+        result = Result.objects.create(student=student, test=test, score=score, total_questions=len(questions))
+        for row in rows:
+            row.result = result
+        StudentAnswer.objects.bulk_create(rows)
+    return result
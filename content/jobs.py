@@ -0,0 +1,89 @@
+import logging
+
+from django.db import router, transaction
+
+from core.versions import bump_version
+from jobs.queue import job
+from .chat import recent_messages, room_version_name
+from .extraction import attached_file, extract_pdf_text, file_digest, is_pdf
+from .models import ChatMessage, ExtractedText, Notification
+from .search import KINDS, index_items, kind_of
+
+logger = logging.getLogger(__name__)
+
+
+@job(batched=True)
+def create_notifications(payloads):
+    """Create queued personal notifications with one insert."""
+    Notification.objects.bulk_create([Notification(**payload) for payload in payloads])
+    # bulk_create skips the signal that invalidates the recipients' badges
+    recipients = {payload['recipient_id'] for payload in payloads}
+    transaction.on_commit(lambda: [bump_version(f'notifications:{pk}') for pk in recipients])
+
+
+@job()
+def delete_user_chat_messages(user_id):
+    """Delete a deleted user's chat messages and drop the rooms they were in from the buffers."""
+    messages = ChatMessage.objects.filter(author_id=user_id)
+    rooms = set(messages.values_list('year', 'stream').distinct())
+    if not rooms:
+        return
+    messages.delete()
+
+    def on_commit():
+        for year, stream in rooms:
+            bump_version(room_version_name(year, stream))
+            recent_messages.invalidate((year, stream))
+
+    transaction.on_commit(on_commit, using=router.db_for_write(ChatMessage))
+
+
+def update_extracted_text(item):
+    """
+    Extract the text of an item's PDF, unless the file's contents are the
+    ones extracted last time, and reindex the item with it. Returns
+    ``'extracted'``, ``'unchanged'`` or ``'skipped'``.
+    """
+    kind = kind_of(item)
+    file = attached_file(item)
+    extracted = ExtractedText.objects.filter(kind=kind, object_id=item.pk).first()
+    if not is_pdf(file):
+        if extracted:
+            extracted.delete()
+            index_items([item])
+        return 'skipped'
+
+    try:
+        digest = file_digest(file)
+    except FileNotFoundError:
+        logger.warning('%s is missing from storage', file.name)
+        return 'skipped'
+
+    if extracted and extracted.sha256 == digest:
+        if extracted.file_name == file.name:
+            return 'unchanged'
+        # Same contents under a new name
+        extracted.file_name = file.name
+        extracted.save(update_fields=['file_name'])
+        index_items([item])
+        return 'unchanged'
+
+    try:
+        text, page_count = extract_pdf_text(file)
+    except ImportError:
+        logger.warning('pypdf is not installed; the text of %s is not indexed', file.name)
+        return 'skipped'
+    ExtractedText.objects.update_or_create(kind=kind, object_id=item.pk, defaults={
+        'file_name': file.name, 'sha256': digest, 'text': text, 'page_count': page_count
+    })
+    index_items([item])
+    return 'extracted'
+
+
+@job()
+def extract_attachment_text(kind, object_id):
+    """Extract and index the text of an uploaded PDF, off the upload request."""
+    item = KINDS[kind].objects.filter(pk=object_id).first()
+    if item is not None:
+        update_extracted_text(item)
+
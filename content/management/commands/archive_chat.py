@@ -0,0 +1,109 @@
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import router, transaction
+from django.db.models import DateField
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from core.versions import bump_version
+from content.chat import (
+    message_rows, pack_entries, recent_messages, room_version_name, row_entry, unpack_entries
+)
+from content.models import ChatMessage, ChatArchive
+
+
+class Command(BaseCommand):
+    help = (
+        'Moves chat messages older than the retention window into compressed '
+        'per-room, per-month archives, writing each archive once per run, and '
+        'deletes them from the message table in batches. Archived messages '
+        'stay readable through the history API.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=settings.CHAT_RETENTION_DAYS,
+            help='Archive messages older than this many days'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=settings.CHAT_ARCHIVE_BATCH_SIZE,
+            help='Messages moved per transaction'
+        )
+        parser.add_argument('--dry-run', action='store_true', help='Only count the messages that would be archived')
+
+    def handle(self, *args, **options):
+        if options['days'] < 1 or options['batch_size'] < 1:
+            raise CommandError('--days and --batch-size must be at least 1.')
+
+        started = time.monotonic()
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        old = ChatMessage.objects.filter(created_at__lt=cutoff)
+
+        if options['dry_run']:
+            self.stdout.write(f'{old.count()} messages older than {cutoff:%Y-%m-%d} would be archived.')
+            return
+
+        archived = dropped = batches = 0
+        rooms = set()
+        months = (
+            old.annotate(month=TruncMonth('created_at', output_field=DateField(), tzinfo=dt_timezone.utc))
+            .values_list('year', 'stream', 'month').distinct().order_by('month', 'year', 'stream')
+        )
+        for year, stream, month in months:
+            next_month = (month + timedelta(days=31)).replace(day=1)
+            rows = message_rows(
+                old.filter(
+                    year=year, stream=stream,
+                    created_at__gte=datetime(month.year, month.month, 1, tzinfo=dt_timezone.utc),
+                    created_at__lt=datetime(next_month.year, next_month.month, 1, tzinfo=dt_timezone.utc),
+                ).order_by('id'),
+                'is_removed'
+            )
+            if not rows:
+                continue
+            archived += self.archive_month(year, stream, month, [row for row in rows if not row['is_removed']])
+            dropped += sum(1 for row in rows if row['is_removed'])
+            rooms.add((year, stream))
+
+            # Deleting in short transactions keeps the table available. A run
+            # interrupted here archives the remaining rows again next time,
+            # which the merge by id makes harmless.
+            ids = [row['id'] for row in rows]
+            for start in range(0, len(ids), options['batch_size']):
+                with transaction.atomic(using=router.db_for_write(ChatMessage)):
+                    ChatMessage.objects.filter(id__in=ids[start:start + options['batch_size']]).delete()
+                batches += 1
+
+        # Archived messages may still sit in room buffers
+        for year, stream in rooms:
+            bump_version(room_version_name(year, stream))
+            recent_messages.invalidate((year, stream))
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Archived {archived} messages and dropped {dropped} removed ones from {len(rooms)} rooms '
+            f'in {batches} batches ({time.monotonic() - started:.1f}s).'
+        ))
+
+    def archive_month(self, year, stream, month, rows):
+        """
+        Merge the rows of one room and month into its archive, compressing
+        and writing it once. Returns the number of messages added.
+        """
+        entries = [row_entry(row) for row in rows]
+        if not entries:
+            return 0
+        with transaction.atomic(using=router.db_for_write(ChatArchive)):
+            archive = ChatArchive.objects.select_for_update().filter(year=year, stream=stream, month=month).first()
+            if archive is None:
+                archive = ChatArchive(year=year, stream=stream, month=month)
+            else:
+                new_ids = {entry['id'] for entry in entries}
+                entries += [entry for entry in unpack_entries(archive.data) if entry['id'] not in new_ids]
+            entries.sort(key=lambda entry: (entry['created_at'], entry['id']))
+            archive.data = pack_entries(entries)
+            archive.message_count = len(entries)
+            archive.save()
+        return len(rows)
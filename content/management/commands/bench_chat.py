@@ -0,0 +1,190 @@
+import json
+import math
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from content.models import ChatMessage
+from users.models import CustomUser, YEAR_CHOICES, STREAM_CHOICES
+
+USERNAME_PREFIX = 'bench_'
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a sorted list."""
+    if not values:
+        return 0.0
+    rank = max(math.ceil(pct / 100 * len(values)), 1)
+    return values[rank - 1]
+
+
+def summarize(samples):
+    latencies = sorted(elapsed for _, elapsed, _, _ in samples)
+    queries = sum(count for _, _, count, _ in samples)
+    return {
+        'requests': len(samples),
+        'errors': sum(1 for _, _, _, status in samples if status is None or (status >= 400 and status != 429)),
+        'rate_limited': sum(1 for _, _, _, status in samples if status == 429),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        'queries_per_request': round(queries / len(samples), 2) if samples else 0.0,
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmarks the chat endpoints. Seeds students in every year/stream room, '
+        'then has each of them load the room and keep polling it, sometimes sending '
+        'a message, through the test client from concurrent threads. Reports '
+        'latency percentiles, queries per request and throughput.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users-per-room', type=int, default=3, help='Simulated students per room')
+        parser.add_argument('--requests', type=int, default=50, help='Requests made by each simulated student')
+        parser.add_argument('--concurrency', type=int, default=8, help='Number of client threads')
+        parser.add_argument('--send-ratio', type=float, default=0.1, help='Share of requests that send a message')
+        parser.add_argument('--seed', type=int, help='Random seed, for repeatable runs')
+        parser.add_argument('--keep', action='store_true', help='Keep the seeded students and their messages')
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+
+    def handle(self, *args, **options):
+        if options['users_per_room'] < 1 or options['requests'] < 1 or options['concurrency'] < 1:
+            raise CommandError('--users-per-room, --requests and --concurrency must be at least 1.')
+        if not 0 <= options['send_ratio'] <= 1:
+            raise CommandError('--send-ratio must be between 0 and 1.')
+
+        rng = random.Random(options['seed'])
+        users = self.seed_users(options['users_per_room'])
+        jobs = [(user, rng.random()) for user in users]
+        try:
+            # The test client talks to the "testserver" host
+            with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+                start = time.perf_counter()
+                if options['concurrency'] == 1:
+                    results = [self.simulate(user, seed, options) for user, seed in jobs]
+                else:
+                    with ThreadPoolExecutor(max_workers=options['concurrency']) as pool:
+                        results = list(pool.map(lambda job: self.run_thread(*job, options), jobs))
+                duration = time.perf_counter() - start
+        finally:
+            if not options['keep']:
+                seeded = CustomUser.objects.filter(username__startswith=USERNAME_PREFIX)
+                # Deleted here rather than left to the user deletion job
+                ChatMessage.objects.filter(author_id__in=list(seeded.values_list('id', flat=True))).delete()
+                seeded.delete()
+
+        samples = [sample for result in results for sample in result]
+        report = {
+            'rooms': len(YEAR_CHOICES) * len(STREAM_CHOICES),
+            'users': len(users),
+            'concurrency': options['concurrency'],
+            'duration_s': round(duration, 3),
+            'throughput_rps': round(len(samples) / duration, 1) if duration else 0.0,
+            'all': summarize(samples),
+            'get': summarize([s for s in samples if s[0] == 'get']),
+            'send': summarize([s for s in samples if s[0] == 'send']),
+        }
+        if options['json']:
+            self.stdout.write(json.dumps(report))
+        else:
+            self.print_report(report)
+
+    def seed_users(self, per_room):
+        wanted = {
+            f'{USERNAME_PREFIX}{year}_{stream}_{n}': (year, stream)
+            for year, _ in YEAR_CHOICES
+            for stream, _ in STREAM_CHOICES
+            for n in range(per_room)
+        }
+        existing = set(CustomUser.objects.filter(username__in=wanted).values_list('username', flat=True))
+        new_users = []
+        for username, (year, stream) in wanted.items():
+            if username in existing:
+                continue
+            user = CustomUser(username=username, year=year, stream=stream, is_student=True, is_active=True)
+            user.set_unusable_password()
+            new_users.append(user)
+        # bulk_create skips CustomUser.save(), which would leave new students inactive
+        CustomUser.objects.bulk_create(new_users)
+        return list(CustomUser.objects.filter(username__in=wanted).order_by('username'))
+
+    def run_thread(self, user, seed, options):
+        try:
+            return self.simulate(user, seed, options)
+        finally:
+            connections.close_all()
+
+    def simulate(self, user, seed, options):
+        """
+        One student: load the room, then poll it for changes like chat.html does
+        (with the last version and ETag), sending a message now and then.
+        Returns ``(operation, seconds, queries, status)`` samples, with a None
+        status for requests that raised.
+        """
+        rng = random.Random(seed)
+        client = Client()
+        client.force_login(user)
+        send_url = reverse('send_message', args=[user.year, user.stream])
+        get_url = reverse('get_messages', args=[user.year, user.stream])
+        since = etag = None
+        samples = []
+
+        for i in range(options['requests']):
+            sending = since is not None and rng.random() < options['send_ratio']
+            with ExitStack() as stack:
+                captures = [stack.enter_context(CaptureQueriesContext(connection)) for connection in connections.all()]
+                start = time.perf_counter()
+                try:
+                    if sending:
+                        response = client.post(
+                            send_url, {'message': f'Benchmark message {i}'},
+                            HTTP_X_REQUESTED_WITH='XMLHttpRequest'
+                        )
+                    else:
+                        params = {'since': since} if since is not None else {}
+                        headers = {'HTTP_IF_NONE_MATCH': etag} if etag else {}
+                        response = client.get(get_url, params, **headers)
+                    status = response.status_code
+                except Exception:
+                    # e.g. "database is locked" under heavy write contention
+                    status = None
+                elapsed = time.perf_counter() - start
+            samples.append(('send' if sending else 'get', elapsed, sum(len(c) for c in captures), status))
+
+            if not sending and status == 200:
+                since = response.json()['version']
+                etag = response.get('ETag')
+        return samples
+
+    def print_report(self, report):
+        self.stdout.write(
+            f"Chat benchmark: {report['users']} users in {report['rooms']} rooms, "
+            f"{report['concurrency']} threads, {report['all']['requests']} requests in "
+            f"{report['duration_s']}s ({report['throughput_rps']} req/s)"
+        )
+        self.stdout.write(
+            f"{'operation':<10}{'requests':>10}{'errors':>8}{'limited':>9}"
+            f"{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'queries/req':>13}"
+        )
+        for operation in ('get', 'send', 'all'):
+            row = report[operation]
+            self.stdout.write(
+                f"{operation:<10}{row['requests']:>10}{row['errors']:>8}{row['rate_limited']:>9}{row['p50_ms']:>10}"
+                f"{row['p95_ms']:>10}{row['p99_ms']:>10}{row['queries_per_request']:>13}"
+            )
+        if report['all']['errors']:
+            self.stdout.write(self.style.WARNING(f"{report['all']['errors']} requests failed."))
+        if report['all']['rate_limited']:
+            self.stdout.write(self.style.WARNING(
+                f"{report['all']['rate_limited']} sends were rate limited; see CHAT_SEND_BURST and CHAT_SEND_PER_MINUTE."
+            ))
@@ -0,0 +1,36 @@
+import time
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+
+from content.jobs import update_extracted_text
+from content.search import KINDS
+
+
+class Command(BaseCommand):
+    help = (
+        'Extracts and indexes the text of the PDFs attached to lessons, tests '
+        'and resources, e.g. those uploaded before extraction existed. Files '
+        'whose contents were already extracted are skipped.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--kind', choices=list(KINDS), action='append',
+            help='Only process items of this kind (repeatable)'
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        counts = Counter()
+        for kind in options['kind'] or KINDS:
+            model = KINDS[kind]
+            name = 'file' if kind == 'resource' else 'pdf_file'
+            items = model.objects.filter(**{f'{name}__iendswith': '.pdf'}).order_by('pk')
+            for item in items.iterator():
+                counts[update_extracted_text(item)] += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Extracted {counts['extracted']} files, {counts['unchanged']} unchanged, "
+            f"{counts['skipped']} skipped ({time.monotonic() - started:.1f}s)."
+        ))
@@ -0,0 +1,60 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from content.models import Notification
+
+
+class Command(BaseCommand):
+    help = (
+        'Deletes read and removed notifications older than the retention '
+        'window, in small batches so the database is never locked for long. '
+        'Unread notifications are kept. Announcements have no notification '
+        'rows and are not affected.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=settings.NOTIFICATION_RETENTION_DAYS,
+            help='Purge notifications older than this many days'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=settings.NOTIFICATION_PURGE_BATCH_SIZE,
+            help='Notifications deleted per transaction'
+        )
+        parser.add_argument('--dry-run', action='store_true', help='Only count the notifications that would be purged')
+
+    def handle(self, *args, **options):
+        if options['days'] < 1 or options['batch_size'] < 1:
+            raise CommandError('--days and --batch-size must be at least 1.')
+
+        started = time.monotonic()
+        days = options['days']
+        old = Notification.objects.filter(
+            Q(is_read=True) | Q(is_removed=True),
+            created_at__lt=timezone.now() - timedelta(days=days)
+        )
+        if options['dry_run']:
+            self.stdout.write(f'{old.count()} notifications older than {days} days would be purged.')
+            return
+
+        purged = self.purge(old, options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Purged {purged} notifications older than {days} days ({time.monotonic() - started:.1f}s).'
+        ))
+
+    def purge(self, queryset, batch_size):
+        """Delete the rows of ``queryset`` one short transaction per batch."""
+        purged = 0
+        while True:
+            ids = list(queryset.order_by('id').values_list('id', flat=True)[:batch_size])
+            if not ids:
+                return purged
+            with transaction.atomic():
+                Notification.objects.filter(id__in=ids).delete()
+            purged += len(ids)
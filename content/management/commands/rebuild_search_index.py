@@ -0,0 +1,51 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, router, transaction
+
+from content.models import SearchDocument
+from content.search import FTS_TABLE, KINDS, index_items, uses_fts
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuilds the search index from scratch: rewrites the document of every '
+        'approved, non-removed lesson, test and resource, then rebuilds and '
+        'optimizes the full-text index.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=settings.SEARCH_INDEX_BATCH_SIZE,
+            help='Items indexed per insert'
+        )
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1.')
+
+        started = time.monotonic()
+        counts = {}
+        with transaction.atomic(using=router.db_for_write(SearchDocument)):
+            SearchDocument.objects.all().delete()
+            for kind, model in KINDS.items():
+                items = model.objects.filter(is_approved=True, is_removed=False).order_by('pk')
+                batch = []
+                counts[kind] = 0
+                for item in items.iterator(chunk_size=options['batch_size']):
+                    batch.append(item)
+                    if len(batch) == options['batch_size']:
+                        index_items(batch)
+                        counts[kind] += len(batch)
+                        batch = []
+                index_items(batch)
+                counts[kind] += len(batch)
+
+            if uses_fts():
+                with connections[router.db_for_write(SearchDocument)].cursor() as cursor:
+                    cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+                    cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')")
+
+        summary = ', '.join(f'{count} {kind}s' for kind, count in counts.items())
+        self.stdout.write(self.style.SUCCESS(f'Indexed {summary} ({time.monotonic() - started:.1f}s).'))
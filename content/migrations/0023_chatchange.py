@@ -0,0 +1,28 @@
+# Generated by Django 6.0.1 on 2026-10-17 12:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('content', '0022_announcement_is_removed_notification_is_removed_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChatChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.IntegerField(choices=[(1, 'First Year'), (2, 'Second Year'), (3, 'Third Year')], verbose_name='Year')),
+                ('stream', models.CharField(choices=[('common_science', 'Common Science'), ('common_literature', 'Common Literature'), ('math', 'Math Stream'), ('science', 'Science Stream'), ('languages', 'Languages Stream'), ('literature', 'Literature Stream'), ('management_economics', 'Management & Economics Stream'), ('civil_engineering', 'Civil Engineering Stream')], max_length=50, verbose_name='Stream')),
+                ('kind', models.CharField(choices=[('create', 'Created'), ('edit', 'Edited'), ('remove', 'Removed')], max_length=10, verbose_name='Kind')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created At')),
+                ('message', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='changes', to='content.chatmessage', verbose_name='Message')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['year', 'stream', 'id'], name='content_cha_year_36ecb0_idx')],
+            },
+        ),
+    ]
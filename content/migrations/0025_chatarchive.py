@@ -0,0 +1,28 @@
+# Generated by Django 6.0.1 on 2026-10-17 13:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('content', '0024_chatmessage_author_db_constraint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChatArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.IntegerField(choices=[(1, 'First Year'), (2, 'Second Year'), (3, 'Third Year')], verbose_name='Year')),
+                ('stream', models.CharField(choices=[('common_science', 'Common Science'), ('common_literature', 'Common Literature'), ('math', 'Math Stream'), ('science', 'Science Stream'), ('languages', 'Languages Stream'), ('literature', 'Literature Stream'), ('management_economics', 'Management & Economics Stream'), ('civil_engineering', 'Civil Engineering Stream')], max_length=50, verbose_name='Stream')),
+                ('month', models.DateField(verbose_name='Month')),
+                ('message_count', models.PositiveIntegerField(default=0, verbose_name='Message Count')),
+                ('data', models.BinaryField(verbose_name='Data')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Updated At')),
+            ],
+            options={
+                'unique_together': {('year', 'stream', 'month')},
+            },
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 6.0.1 on 2026-10-17 13:46
+
+from datetime import timedelta
+
+from django.db import migrations
+from django.db.models import Min
+
+
+def fold_announcement_notifications(apps, schema_editor):
+    """
+    Announcements are now broadcast and read state comes from each user's
+    announcements_seen_at watermark, so the per-user announcement rows go.
+    Users with unread ones get their watermark moved back to just before the
+    oldest of them, so those announcements stay unread.
+    """
+    Notification = apps.get_model('content', 'Notification')
+    CustomUser = apps.get_model('users', 'CustomUser')
+    db = schema_editor.connection.alias
+
+    announcement_rows = Notification.objects.using(db).filter(announcement__isnull=False)
+    unread = (
+        announcement_rows.filter(is_read=False, is_removed=False)
+        .values('recipient_id').annotate(oldest=Min('announcement__created_at'))
+    )
+    for row in unread:
+        CustomUser.objects.using(db).filter(pk=row['recipient_id']).update(
+            announcements_seen_at=row['oldest'] - timedelta(microseconds=1)
+        )
+    announcement_rows.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('content', '0025_chatarchive'),
+        ('users', '0008_customuser_announcements_seen_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(fold_announcement_notifications, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,104 @@
+# Generated by Django 6.0.1 on 2026-10-17 14:40
+
+from django.db import migrations, models
+from django.utils.html import strip_tags
+
+# External-content FTS5 index over content_searchdocument, kept in step by
+# triggers. Only created on SQLite; other databases search the table itself.
+FTS_SQL = [
+    """
+    CREATE VIRTUAL TABLE content_searchdocument_fts USING fts5(
+        title, body,
+        content='content_searchdocument', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER content_searchdocument_ai AFTER INSERT ON content_searchdocument BEGIN
+        INSERT INTO content_searchdocument_fts(rowid, title, body) VALUES (new.id, new.title, new.body);
+    END
+    """,
+    """
+    CREATE TRIGGER content_searchdocument_ad AFTER DELETE ON content_searchdocument BEGIN
+        INSERT INTO content_searchdocument_fts(content_searchdocument_fts, rowid, title, body)
+        VALUES ('delete', old.id, old.title, old.body);
+    END
+    """,
+    """
+    CREATE TRIGGER content_searchdocument_au AFTER UPDATE ON content_searchdocument BEGIN
+        INSERT INTO content_searchdocument_fts(content_searchdocument_fts, rowid, title, body)
+        VALUES ('delete', old.id, old.title, old.body);
+        INSERT INTO content_searchdocument_fts(rowid, title, body) VALUES (new.id, new.title, new.body);
+    END
+    """,
+]
+
+DROP_FTS_SQL = [
+    'DROP TRIGGER IF EXISTS content_searchdocument_ai',
+    'DROP TRIGGER IF EXISTS content_searchdocument_ad',
+    'DROP TRIGGER IF EXISTS content_searchdocument_au',
+    'DROP TABLE IF EXISTS content_searchdocument_fts',
+]
+
+
+def create_fts_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        for sql in FTS_SQL:
+            schema_editor.execute(sql)
+
+
+def drop_fts_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        for sql in DROP_FTS_SQL:
+            schema_editor.execute(sql)
+
+
+def index_existing_items(apps, schema_editor):
+    # Documents of the items approved before the index existed, as
+    # content.search.index_items writes them; the triggers fill the FTS index.
+    # Historical models don't have the real models' methods, so the text of
+    # each kind is read here the way content.search.source_text reads it.
+    from content.analysis import analyze
+
+    SearchDocument = apps.get_model('content', 'SearchDocument')
+    db = schema_editor.connection.alias
+    sources = [
+        ('lesson', 'Lesson', lambda item: strip_tags(item.content)),
+        ('test', 'Test', lambda item: item.description),
+        ('resource', 'Resource', lambda item: ''),
+    ]
+    for kind, model_name, body in sources:
+        items = apps.get_model('content', model_name).objects.using(db).filter(is_approved=True, is_removed=False)
+        batch = []
+        for item in items.order_by('pk').iterator(chunk_size=500):
+            batch.append(SearchDocument(kind=kind, object_id=item.pk, title=analyze(item.title), body=analyze(body(item))))
+            if len(batch) == 500:
+                SearchDocument.objects.using(db).bulk_create(batch)
+                batch = []
+        SearchDocument.objects.using(db).bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('content', '0027_notification_inbox_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('lesson', 'Lesson'), ('test', 'Test'), ('resource', 'Resource')], max_length=10, verbose_name='Kind')),
+                ('object_id', models.PositiveIntegerField(verbose_name='Object ID')),
+                ('title', models.TextField(verbose_name='Title')),
+                ('body', models.TextField(blank=True, verbose_name='Body')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Updated At')),
+            ],
+            options={
+                'unique_together': {('kind', 'object_id')},
+            },
+        ),
+        migrations.RunPython(create_fts_index, drop_fts_index, hints={'model_name': 'searchdocument'}),
+        migrations.RunPython(index_existing_items, migrations.RunPython.noop, hints={'model_name': 'searchdocument'}),
+    ]
@@ -0,0 +1,99 @@
+# Generated by Django 6.0.1 on 2026-10-17 15:20
+
+from django.db import migrations, models
+
+# The FTS5 index gains an attachment column. Adding the field makes SQLite
+# rebuild content_searchdocument, which drops its triggers, so the index is
+# dropped first and created again afterwards from the table's rows.
+
+FTS_TRIGGERS = [
+    'DROP TRIGGER IF EXISTS content_searchdocument_ai',
+    'DROP TRIGGER IF EXISTS content_searchdocument_ad',
+    'DROP TRIGGER IF EXISTS content_searchdocument_au',
+    'DROP TABLE IF EXISTS content_searchdocument_fts',
+]
+
+
+def fts_sql(columns):
+    names = ', '.join(columns)
+    new = ', '.join(f'new.{column}' for column in columns)
+    old = ', '.join(f'old.{column}' for column in columns)
+    return [
+        f"""
+        CREATE VIRTUAL TABLE content_searchdocument_fts USING fts5(
+            {names},
+            content='content_searchdocument', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+        """,
+        f"""
+        CREATE TRIGGER content_searchdocument_ai AFTER INSERT ON content_searchdocument BEGIN
+            INSERT INTO content_searchdocument_fts(rowid, {names}) VALUES (new.id, {new});
+        END
+        """,
+        f"""
+        CREATE TRIGGER content_searchdocument_ad AFTER DELETE ON content_searchdocument BEGIN
+            INSERT INTO content_searchdocument_fts(content_searchdocument_fts, rowid, {names})
+            VALUES ('delete', old.id, {old});
+        END
+        """,
+        f"""
+        CREATE TRIGGER content_searchdocument_au AFTER UPDATE ON content_searchdocument BEGIN
+            INSERT INTO content_searchdocument_fts(content_searchdocument_fts, rowid, {names})
+            VALUES ('delete', old.id, {old});
+            INSERT INTO content_searchdocument_fts(rowid, {names}) VALUES (new.id, {new});
+        END
+        """,
+        "INSERT INTO content_searchdocument_fts(content_searchdocument_fts) VALUES ('rebuild')",
+    ]
+
+
+def drop_fts_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        for sql in FTS_TRIGGERS:
+            schema_editor.execute(sql)
+
+
+def create_fts_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        for sql in fts_sql(['title', 'body', 'attachment']):
+            schema_editor.execute(sql)
+
+
+def create_old_fts_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        for sql in fts_sql(['title', 'body']):
+            schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('content', '0028_searchdocument'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_fts_index, create_old_fts_index, hints={'model_name': 'searchdocument'}),
+        migrations.AddField(
+            model_name='searchdocument',
+            name='attachment',
+            field=models.TextField(blank=True, default='', verbose_name='Attachment'),
+        ),
+        migrations.CreateModel(
+            name='ExtractedText',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('lesson', 'Lesson'), ('test', 'Test'), ('resource', 'Resource')], max_length=10, verbose_name='Kind')),
+                ('object_id', models.PositiveIntegerField(verbose_name='Object ID')),
+                ('file_name', models.CharField(max_length=255, verbose_name='File Name')),
+                ('sha256', models.CharField(max_length=64, verbose_name='SHA-256')),
+                ('text', models.TextField(blank=True, verbose_name='Text')),
+                ('page_count', models.PositiveIntegerField(default=0, verbose_name='Page Count')),
+                ('extracted_at', models.DateTimeField(auto_now=True, verbose_name='Extracted At')),
+            ],
+            options={
+                'unique_together': {('kind', 'object_id')},
+            },
+        ),
+        migrations.RunPython(create_fts_index, drop_fts_index, hints={'model_name': 'searchdocument'}),
+    ]
@@ -1,9 +1,12 @@
 from django.db import models
 from django.conf import settings
 from django.utils.translation import gettext_lazy as _
+from core.tracking import TrackedFieldsMixin
 from users.models import YEAR_CHOICES, STREAM_CHOICES, SUBJECT_CHOICES
 
-class Lesson(models.Model):
+class Lesson(TrackedFieldsMixin, models.Model):
+    tracked_fields = ('is_approved', 'pdf_file')
+
     title = models.CharField(_('Title'), max_length=200)
     content = models.TextField(_('Content'))
     author = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='lessons', verbose_name=_('Author'))
@@ -30,7 +33,9 @@ class Announcement(models.Model):
     def __str__(self):
         return self.title
 
-class Test(models.Model):
+class Test(TrackedFieldsMixin, models.Model):
+    tracked_fields = ('is_approved', 'pdf_file')
+
     title = models.CharField(_('Title'), max_length=200)
     description = models.TextField(_('Description'), blank=True)
     author = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='tests', verbose_name=_('Author'))
@@ -79,7 +84,11 @@ class Result(models.Model):
         return f"{self.student.username} - {self.test.title} - {self.score}/{self.total_questions}"
 
 class ChatMessage(models.Model):
-    author = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, verbose_name=_('Author'))
+    # Chat may live in its own database (see content.routers), so there is no
+    # database constraint; the author's messages are deleted by a signal.
+    author = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.DO_NOTHING, db_constraint=False, verbose_name=_('Author')
+    )
     year = models.IntegerField(_('Year'), choices=YEAR_CHOICES)
     stream = models.CharField(_('Stream'), max_length=50, choices=STREAM_CHOICES)
     message = models.TextField(_('Message'))
@@ -96,7 +105,56 @@ class ChatMessage(models.Model):
     def __str__(self):
         return f"{self.author.username} - Year {self.year} {self.stream} - {self.created_at}"
 
-class Resource(models.Model):
+class ChatChange(models.Model):
+    """
+    Append-only log of chat writes. Its id is the monotonic change version
+    clients sync from, so edits and removals reach them incrementally.
+    """
+    CREATE = 'create'
+    EDIT = 'edit'
+    REMOVE = 'remove'
+    KIND_CHOICES = [
+        (CREATE, _('Created')),
+        (EDIT, _('Edited')),
+        (REMOVE, _('Removed')),
+    ]
+    message = models.ForeignKey(ChatMessage, on_delete=models.CASCADE, related_name='changes', verbose_name=_('Message'))
+    year = models.IntegerField(_('Year'), choices=YEAR_CHOICES)
+    stream = models.CharField(_('Stream'), max_length=50, choices=STREAM_CHOICES)
+    kind = models.CharField(_('Kind'), max_length=10, choices=KIND_CHOICES)
+    created_at = models.DateTimeField(_('Created At'), auto_now_add=True)
+
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['year', 'stream', 'id']),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} of message {self.message_id} - Year {self.year} {self.stream}"
+
+class ChatArchive(models.Model):
+    """
+    Read-only cold storage for old chat messages, written by the archive_chat
+    command: one zlib-compressed JSON list of message entries per room and month.
+    """
+    year = models.IntegerField(_('Year'), choices=YEAR_CHOICES)
+    stream = models.CharField(_('Stream'), max_length=50, choices=STREAM_CHOICES)
+    month = models.DateField(_('Month'))  # First day of the month (UTC)
+    message_count = models.PositiveIntegerField(_('Message Count'), default=0)
+    data = models.BinaryField(_('Data'))
+    updated_at = models.DateTimeField(_('Updated At'), auto_now=True)
+
+
+    class Meta:
+        unique_together = ('year', 'stream', 'month')
+
+    def __str__(self):
+        return f"Year {self.year} {self.stream} - {self.month:%Y-%m} ({self.message_count} messages)"
+
+class Resource(TrackedFieldsMixin, models.Model):
+    tracked_fields = ('is_approved', 'file')
+
     RESOURCE_TYPES = [
         ('pdf', _('PDF Document')),
         ('video', _('Video Link')),
@@ -193,6 +251,52 @@ class Notification(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Inbox pages and unread counts of one recipient
+            models.Index(fields=['recipient', 'is_removed', 'is_read', '-created_at'], name='notification_inbox_idx'),
+        ]
 
     def __str__(self):
         return f"Notification for {self.recipient.username}: {self.title}"
+
+class SearchDocument(models.Model):
+    """
+    Searchable text of an approved lesson, test or resource. On SQLite the
+    rows are mirrored into a full-text (FTS5) index by triggers; see
+    content.search.
+    """
+    KIND_CHOICES = [
+        ('lesson', _('Lesson')),
+        ('test', _('Test')),
+        ('resource', _('Resource')),
+    ]
+    kind = models.CharField(_('Kind'), max_length=10, choices=KIND_CHOICES)
+    object_id = models.PositiveIntegerField(_('Object ID'))
+    title = models.TextField(_('Title'))
+    body = models.TextField(_('Body'), blank=True)
+    attachment = models.TextField(_('Attachment'), blank=True, default='')
+    updated_at = models.DateTimeField(_('Updated At'), auto_now=True)
+
+
+    class Meta:
+        unique_together = ('kind', 'object_id')
+
+    def __str__(self):
+        return f"{self.kind} {self.object_id}: {self.title}"
+
+class ExtractedText(models.Model):
+    """Text of the PDF attached to a lesson, test or resource, extracted in the background."""
+    kind = models.CharField(_('Kind'), max_length=10, choices=SearchDocument.KIND_CHOICES)
+    object_id = models.PositiveIntegerField(_('Object ID'))
+    file_name = models.CharField(_('File Name'), max_length=255)
+    sha256 = models.CharField(_('SHA-256'), max_length=64)
+    text = models.TextField(_('Text'), blank=True)
+    page_count = models.PositiveIntegerField(_('Page Count'), default=0)
+    extracted_at = models.DateTimeField(_('Extracted At'), auto_now=True)
+
+
+    class Meta:
+        unique_together = ('kind', 'object_id')
+
+    def __str__(self):
+        return f"{self.kind} {self.object_id}: {self.file_name}"
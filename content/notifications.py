@@ -0,0 +1,190 @@
+import binascii
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+from heapq import merge
+from itertools import islice
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+from django.utils.translation import gettext as _
+
+from core.versions import bump_version, get_version
+from users.models import CustomUser
+from .models import Announcement, Lesson, Notification, Resource, Test
+
+# Announcements reach every user without a row per recipient: a user's
+# announcements are those posted since they joined, and the ones newer than
+# their announcements_seen_at watermark are unread.
+
+UNREAD_COUNT_TIMEOUT = 24 * 60 * 60
+
+# Within one timestamp, announcements sort before personal notifications
+BROADCAST, PERSONAL = 0, 1
+
+
+class BroadcastNotification:
+    """An announcement presented as one of a user's notifications."""
+    is_broadcast = True
+
+    def __init__(self, announcement, user):
+        self.pk = announcement.pk
+        self.announcement = announcement
+        self.title = _('New Announcement')
+        self.message = _('New announcement: %(title)s') % {'title': announcement.title}
+        self.link = '/'
+        self.created_at = announcement.created_at
+        self.is_read = announcement.created_at <= user.announcements_seen_at
+
+
+def approval_notification(item):
+    """Fields of the notification telling an author their lesson, test or resource was approved."""
+    if isinstance(item, Lesson):
+        return {
+            'recipient_id': item.author_id,
+            'title': "Lesson Approved",
+            'message': f"Your lesson '{item.title}' has been approved and is now live.",
+            'link': f"/content/lessons/{item.pk}/",
+        }
+    if isinstance(item, Test):
+        return {
+            'recipient_id': item.author_id,
+            'title': "Test Approved",
+            'message': f"Your test '{item.title}' has been approved and is now live.",
+            'link': f"/content/tests/{item.pk}/",
+        }
+    if isinstance(item, Resource):
+        return {
+            'recipient_id': item.author_id,
+            'title': "Resource Approved",
+            'message': f"Your resource '{item.title}' has been approved.",
+            'link': "/content/library/",
+        }
+    raise TypeError(f'No approval notification for {type(item).__name__}')
+
+
+def user_announcements(user):
+    return Announcement.objects.filter(is_removed=False, created_at__gte=user.date_joined)
+
+
+def inbox_key(notification):
+    """Sort key of the inbox, which lists notifications by descending key."""
+    source = BROADCAST if getattr(notification, 'is_broadcast', False) else PERSONAL
+    return notification.created_at, source, notification.pk
+
+
+def encode_cursor(notification):
+    created_at, source, pk = inbox_key(notification)
+    raw = f'{created_at.isoformat()}|{source}|{pk}'
+    return urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return ``(created_at, source, pk)`` for a cursor; raises ValueError if it is malformed."""
+    try:
+        raw = urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        created_at, source, pk = raw.split('|')
+        source = int(source)
+        if source not in (BROADCAST, PERSONAL):
+            raise ValueError('Invalid cursor')
+        return datetime.fromisoformat(created_at), source, int(pk)
+    except (TypeError, UnicodeDecodeError, binascii.Error) as e:
+        raise ValueError('Invalid cursor') from e
+
+
+def notification_page(user, before=None, limit=None):
+    """
+    One page of a user's personal notifications and announcements, newest
+    first. Returns ``(notifications, next_cursor)``; ``next_cursor`` is None
+    on the last page. Both sources are read by keyset from ``before`` (a
+    cursor of the last notification already shown), so each page costs two
+    index range scans however deep the user pages.
+    """
+    limit = limit or settings.NOTIFICATIONS_PAGE_SIZE
+    personal = Notification.objects.filter(recipient=user, is_removed=False)
+    announcements = user_announcements(user).only('id', 'title', 'created_at')
+    if before:
+        created_at, source, pk = decode_cursor(before)
+        if source == PERSONAL:
+            personal = personal.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+            announcements = announcements.filter(created_at__lte=created_at)
+        else:
+            personal = personal.filter(created_at__lt=created_at)
+            announcements = announcements.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+
+    personal = personal.order_by('-created_at', '-id')[:limit + 1]
+    broadcasts = (
+        BroadcastNotification(announcement, user)
+        for announcement in announcements.order_by('-created_at', '-id')[:limit + 1]
+    )
+    notifications = list(islice(merge(personal, broadcasts, key=inbox_key, reverse=True), limit + 1))
+    if len(notifications) > limit:
+        return notifications[:limit], encode_cursor(notifications[limit - 1])
+    return notifications, None
+
+
+def unread_notification_count(user):
+    return (
+        Notification.objects.filter(recipient=user, is_removed=False, is_read=False).count()
+        + user_announcements(user).filter(created_at__gt=user.announcements_seen_at).count()
+    )
+
+
+def cached_unread_notification_count(user):
+    """
+    ``unread_notification_count`` served from the cache, so rendering the
+    navbar runs no query. The key carries the user's notification version and
+    the announcement version, which every change that can move the count
+    bumps on commit, so a new count is computed as soon as one is needed.
+    """
+    notifications_version = get_version(f'notifications:{user.pk}')
+    key = f"unread-notifications:{user.pk}:{notifications_version}:{get_version('announcement')}"
+    count = cache.get(key)
+    if count is None:
+        count = unread_notification_count(user)
+        cache.set(key, count, UNREAD_COUNT_TIMEOUT)
+    return count
+
+
+def mark_announcements_seen(user, until):
+    """Move the user's watermark forward to ``until``; it never moves back."""
+    updated = CustomUser.objects.filter(pk=user.pk, announcements_seen_at__lt=until).update(announcements_seen_at=until)
+    if updated:
+        user.announcements_seen_at = until
+        # Queryset updates skip the user signals; only this user's badge changed
+        transaction.on_commit(lambda: bump_version(f'notifications:{user.pk}'))
+
+
+def mark_all_read(user):
+    """Mark every notification of the user read: one UPDATE for each source."""
+    updated = Notification.objects.filter(recipient=user, is_removed=False, is_read=False).update(is_read=True)
+    if updated:
+        transaction.on_commit(lambda: bump_version(f'notifications:{user.pk}'))
+    latest = user_announcements(user).order_by('-created_at').values_list('created_at', flat=True).first()
+    if latest:
+        mark_announcements_seen(user, latest)
+    return updated
+
+
+def mark_read(user, notification_ids=(), announcement_ids=()):
+    """
+    Mark the given personal notifications read in a single UPDATE. Read
+    state of announcements is a watermark, so selecting some marks every
+    announcement up to the newest selected one read.
+    """
+    updated = 0
+    if notification_ids:
+        updated = Notification.objects.filter(
+            recipient=user, is_removed=False, is_read=False, id__in=notification_ids
+        ).update(is_read=True)
+        if updated:
+            transaction.on_commit(lambda: bump_version(f'notifications:{user.pk}'))
+    if announcement_ids:
+        latest = (
+            user_announcements(user).filter(id__in=announcement_ids)
+            .order_by('-created_at').values_list('created_at', flat=True).first()
+        )
+        if latest:
+            mark_announcements_seen(user, latest)
+    return updated
@@ -0,0 +1,58 @@
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+
+class ChatRouter:
+    """
+    Routes the chat tables (messages, their change log and archives) to the
+    ``chat`` database when that alias is configured; otherwise it stays out of
+    the way and everything lives in ``default``.
+
+    Chat rows only point at users, which stay in ``default``, so the author
+    foreign key carries no database constraint and the author's messages are
+    deleted by a signal rather than by cascade.
+    """
+
+    alias = 'chat'
+    app_label = 'content'
+    model_names = {'chatmessage', 'chatchange', 'chatarchive'}
+
+    def enabled(self):
+        return self.alias in settings.DATABASES
+
+    def is_chat_model(self, model):
+        # Takes a model class or instance
+        return model._meta.app_label == self.app_label and model._meta.model_name in self.model_names
+
+    def _db_for(self, model, **hints):
+        if not self.enabled():
+            return None
+        if self.is_chat_model(model):
+            return self.alias
+        # Django would otherwise follow a relation into the instance's database
+        instance = hints.get('instance')
+        if instance is not None and self.is_chat_model(instance):
+            return DEFAULT_DB_ALIAS
+        return None
+
+    def db_for_read(self, model, **hints):
+        return self._db_for(model, **hints)
+
+    def db_for_write(self, model, **hints):
+        return self._db_for(model, **hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if self.enabled() and (self.is_chat_model(obj1) or self.is_chat_model(obj2)):
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if not self.enabled():
+            return None
+        is_chat = app_label == self.app_label and model_name in self.model_names
+        if db == self.alias:
+            return is_chat
+        if is_chat:
+            return False
+        return None
+
@@ -0,0 +1,288 @@
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db import connections, router, transaction
+from django.db.models import Count, Q
+from django.utils.html import escape, strip_tags
+from django.utils.safestring import mark_safe
+
+from core.versions import bump_version, get_version, make_etag
+from .analysis import SOURCE_WORD, analyze, tokenize
+from .autocomplete import SEARCH_VERSION, title_index
+from .extraction import attached_file
+from .models import ExtractedText, Lesson, Resource, SearchDocument, Test
+
+# Approved, non-removed lessons, tests and resources each have a
+# SearchDocument row, written by the signals whenever the item is saved. On
+# SQLite those rows are mirrored into the content_searchdocument_fts FTS5
+# index by triggers (see migration 0028), so a search is an index lookup
+# ranked by bm25 instead of a LIKE scan over every row. Documents and queries
+# go through the same normalization (content.analysis).
+#
+# Results are cached per normalized query under the SEARCH_VERSION counter,
+# which every change to the index bumps, so a cached result is never served
+# once an item was approved, edited or removed.
+
+KINDS = {'lesson': Lesson, 'test': Test, 'resource': Resource}
+
+# bm25 column weights: a match in the title counts ten times a body match,
+# which counts twice a match in the attached PDF
+TITLE_WEIGHT = 10.0
+BODY_WEIGHT = 1.0
+ATTACHMENT_WEIGHT = 0.5
+
+FTS_TABLE = 'content_searchdocument_fts'
+
+# Cache counters of cached_search, for monitoring
+CACHE_HITS = 'search-cache:hits'
+CACHE_MISSES = 'search-cache:misses'
+
+
+def kind_of(item):
+    for kind, model in KINDS.items():
+        if isinstance(item, model):
+            return kind
+    raise TypeError(f'{type(item).__name__} is not searchable')
+
+
+def is_searchable(item):
+    return item.is_approved and not item.is_removed
+
+
+def source_text(item):
+    """``(title, body)`` of a lesson, test or resource, as readers see them."""
+    if isinstance(item, Lesson):
+        return item.title, strip_tags(item.content)
+    if isinstance(item, Test):
+        return item.title, item.description
+    return item.title, ''
+
+
+def extracted_texts(items):
+    """
+    ``{(kind, id): text}`` extracted from the PDFs the items have now; text
+    extracted from a replaced file is left out.
+    """
+    files = {(kind_of(item), item.pk): attached_file(item).name for item in items if attached_file(item)}
+    if not files:
+        return {}
+    condition = Q()
+    for kind, object_id in files:
+        condition |= Q(kind=kind, object_id=object_id)
+    return {
+        (kind, object_id): text
+        for kind, object_id, file_name, text in ExtractedText.objects.filter(condition).values_list(
+            'kind', 'object_id', 'file_name', 'text'
+        )
+        if files[(kind, object_id)] == file_name
+    }
+
+
+def index_items(items):
+    """Write the documents of the searchable items and drop those of the others."""
+    items = list(items)
+    attachments = extracted_texts([item for item in items if is_searchable(item)])
+    documents = []
+    titles = []
+    dropped = defaultdict(list)
+    for item in items:
+        kind = kind_of(item)
+        if is_searchable(item):
+            title, body = source_text(item)
+            documents.append(SearchDocument(
+                kind=kind, object_id=item.pk, title=analyze(title), body=analyze(body),
+                attachment=analyze(attachments.get((kind, item.pk), ''))
+            ))
+            titles.append((kind, item.pk, item.title))
+        else:
+            dropped[kind].append(item.pk)
+
+    for kind, ids in dropped.items():
+        remove_from_index(kind, ids)
+    if documents:
+        SearchDocument.objects.bulk_create(
+            documents, update_conflicts=True,
+            unique_fields=['kind', 'object_id'], update_fields=['title', 'body', 'attachment', 'updated_at']
+        )
+        index_changed(titles)
+
+
+def reindex(model, ids):
+    """Re-read and index the given items, e.g. after a queryset update skipped the signals."""
+    index_items(model.objects.filter(id__in=ids))
+
+
+def remove_from_index(kind, ids):
+    deleted, _ = SearchDocument.objects.filter(kind=kind, object_id__in=ids).delete()
+    # Drafts and pending items have no document; saving them changes nothing
+    if deleted:
+        index_changed([(kind, pk, None) for pk in ids])
+
+
+def index_changed(titles):
+    """
+    Once the write commits, bump the search version and update this process's
+    title index with the ``(kind, id, title)`` changes (None titles are removals).
+    """
+    def on_commit():
+        title_index.change(titles, bump_version(SEARCH_VERSION))
+
+    transaction.on_commit(on_commit, using=router.db_for_write(SearchDocument))
+
+
+def uses_fts():
+    return connections[router.db_for_read(SearchDocument)].vendor == 'sqlite'
+
+
+def match_expression(terms):
+    # Every term must match, as the start of a word; quoting keeps FTS5
+    # operators typed by users from being interpreted
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def search(query, kinds=None):
+    """
+    Search the index. Returns ``(kind, object_id, rank)`` tuples, best match
+    first; lower ranks are better.
+    """
+    terms = tokenize(query)
+    if not terms:
+        return []
+    kinds = list(kinds or KINDS)
+    if not uses_fts():
+        return _search_table(terms, kinds)
+
+    placeholders = ', '.join(['%s'] * len(kinds))
+    sql = (
+        f'SELECT d.kind, d.object_id, bm25({FTS_TABLE}, %s, %s, %s) AS rank '
+        f'FROM {FTS_TABLE} JOIN content_searchdocument d ON d.id = {FTS_TABLE}.rowid '
+        f'WHERE {FTS_TABLE} MATCH %s AND d.kind IN ({placeholders}) '
+        f'ORDER BY rank, d.id'
+    )
+    with connections[router.db_for_read(SearchDocument)].cursor() as cursor:
+        cursor.execute(sql, [TITLE_WEIGHT, BODY_WEIGHT, ATTACHMENT_WEIGHT, match_expression(terms), *kinds])
+        return cursor.fetchall()
+
+
+def cached_search(query):
+    """``search(query)``, served from the cache while the index is unchanged."""
+    terms = tokenize(query)
+    if not terms:
+        return []
+    # Word order and repeated words don't change the results
+    key = f'search-results:{get_version(SEARCH_VERSION)}:{make_etag(*sorted(set(terms)))}'
+    hits = cache.get(key)
+    if hits is not None:
+        count_lookup(CACHE_HITS)
+        return hits
+    count_lookup(CACHE_MISSES)
+    hits = search(query)
+    cache.set(key, hits, settings.SEARCH_CACHE_TIMEOUT)
+    return hits
+
+
+def count_lookup(name):
+    try:
+        cache.incr(name)
+    except ValueError:
+        # First lookup since the counter was reset or evicted
+        cache.add(name, 0, None)
+        cache.incr(name)
+
+
+def search_cache_stats():
+    """``{'hits': ..., 'misses': ...}`` of cached_search in every process sharing the cache."""
+    counts = cache.get_many([CACHE_HITS, CACHE_MISSES])
+    return {'hits': counts.get(CACHE_HITS, 0), 'misses': counts.get(CACHE_MISSES, 0)}
+
+
+def _search_table(terms, kinds):
+    # Databases without FTS5 scan the document table; title matches rank first
+    documents = SearchDocument.objects.filter(kind__in=kinds)
+    for term in terms:
+        documents = documents.filter(Q(title__icontains=term) | Q(body__icontains=term) | Q(attachment__icontains=term))
+    hits = []
+    for kind, object_id, title in documents.order_by('id').values_list('kind', 'object_id', 'title'):
+        hits.append((kind, object_id, -float(sum(term in title for term in terms))))
+    return sorted(hits, key=lambda hit: hit[2])
+
+
+def ranked_objects(queryset, ids):
+    """The objects of ``queryset`` with the given ids, in the order of ``ids``."""
+    objects = queryset.in_bulk(ids)
+    return [objects[pk] for pk in ids if pk in objects]
+
+
+def result_querysets():
+    """What search results show of each kind, with what their cards need."""
+    return {
+        'lesson': Lesson.objects.filter(is_approved=True, is_removed=False).select_related('author'),
+        'test': (
+            Test.objects.filter(is_approved=True, is_removed=False).select_related('author')
+            .annotate(question_count=Count('questions'))
+        ),
+        'resource': Resource.objects.filter(is_approved=True, is_removed=False).select_related('author'),
+    }
+
+
+def search_results(query, page_numbers):
+    """
+    Search and return one page of results of each kind, best match first.
+    ``page_numbers`` maps kinds to the requested page number. Only the items
+    on the returned pages are loaded, each with ``highlighted_title`` and a
+    ``snippet`` of its text, or of its PDF's text, around the first match.
+    """
+    hits = defaultdict(list)
+    for kind, object_id, rank in cached_search(query):
+        hits[kind].append(object_id)
+    terms = tokenize(query)
+
+    pages = {}
+    for kind, queryset in result_querysets().items():
+        page = Paginator(hits[kind], settings.SEARCH_RESULTS_PER_PAGE).get_page(page_numbers.get(kind))
+        page.object_list = ranked_objects(queryset, list(page.object_list))
+        attachments = extracted_texts(page.object_list)
+        for item in page.object_list:
+            title, body = source_text(item)
+            attachment = attachments.get((kind, item.pk))
+            if attachment and not any(matches(word, terms) for word in SOURCE_WORD.findall(body)):
+                # Matched in the PDF only; show where
+                body = attachment
+            item.highlighted_title = highlight(title, terms)
+            item.snippet = snippet(body, terms)
+        pages[kind] = page
+    return pages
+
+
+def matches(word, terms):
+    # The same test as the index: a term matches the start of a token
+    return any(token.startswith(term) for token in tokenize(word) for term in terms)
+
+
+def highlight(text, terms):
+    """``text`` escaped, with the words matching ``terms`` wrapped in ``<mark>``."""
+    parts = []
+    last = 0
+    for match in SOURCE_WORD.finditer(text):
+        if matches(match.group(), terms):
+            parts += [escape(text[last:match.start()]), '<mark>', escape(match.group()), '</mark>']
+            last = match.end()
+    parts.append(escape(text[last:]))
+    return mark_safe(''.join(parts))
+
+
+def snippet(text, terms, length=None):
+    """About ``length`` words of ``text`` starting shortly before its first match, highlighted."""
+    length = length or settings.SEARCH_SNIPPET_WORDS
+    words = list(SOURCE_WORD.finditer(text))
+    if not words:
+        return ''
+    first = next((i for i, word in enumerate(words) if matches(word.group(), terms)), 0)
+    start = max(0, min(first - length // 4, len(words) - length))
+    window = words[start:start + length]
+    html = highlight(' '.join(text[window[0].start():window[-1].end()].split()), terms)
+    before = '… ' if start > 0 else ''
+    after = ' …' if start + length < len(words) else ''
+    return mark_safe(f'{before}{html}{after}')
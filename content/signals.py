@@ -1,75 +1,118 @@
-from django.db.models.signals import post_save, post_delete
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, pre_delete
 from django.dispatch import receiver
-from .models import Lesson, Test, Resource, Announcement, Notification
-from django.contrib.auth import get_user_model
+from .models import Lesson, Test, Question, Resource, Announcement, Notification, ChatMessage, ChatChange, ExtractedText
+from .chat import chat_broker, recent_messages, message_entry, room_version_name
+from .jobs import create_notifications, delete_user_chat_messages, extract_attachment_text
+from .grading import question_version_name
+from .notifications import approval_notification
+from .search import index_items, kind_of, remove_from_index
+from core.versions import bump_version
+from jobs.jobs import delete_files
+from jobs.queue import enqueue
+
+def was_approved(instance, created):
+    # Only the save that approves an existing item, not later edits or removals
+    return not created and instance.is_approved and instance.has_changed('is_approved')
 
 @receiver(post_save, sender=Lesson)
-def notify_lesson_approval(sender, instance, created, **kwargs):
-    if not created and instance.is_approved:
-        # Check if it was just approved (naive check, assuming if it's approved and not created, it's an approval action)
-        # Ideally we'd check against previous state, but this is a simple implementation
-        Notification.objects.create(
-            recipient=instance.author,
-            title="Lesson Approved",
-            message=f"Your lesson '{instance.title}' has been approved and is now live.",
-            link=f"/content/lessons/{instance.pk}/"
-        )
+@receiver(post_save, sender=Test)
+@receiver(post_save, sender=Resource)
+def notify_approval(sender, instance, created, **kwargs):
+    # Bulk approvals in the dashboard update rows directly and notify on their own
+    if was_approved(instance, created):
+        enqueue(create_notifications, **approval_notification(instance))
 
+@receiver(post_save, sender=Lesson)
 @receiver(post_save, sender=Test)
-def notify_test_approval(sender, instance, created, **kwargs):
-    if not created and instance.is_approved:
-        Notification.objects.create(
-            recipient=instance.author,
-            title="Test Approved",
-            message=f"Your test '{instance.title}' has been approved and is now live.",
-            link=f"/content/tests/{instance.pk}/"
-        )
+@receiver(post_save, sender=Resource)
+def update_search_index(sender, instance, **kwargs):
+    # Written in the same transaction, so search never sees an uncommitted edit
+    index_items([instance])
+
+@receiver(post_delete, sender=Lesson)
+@receiver(post_delete, sender=Test)
+@receiver(post_delete, sender=Resource)
+def remove_from_search_index(sender, instance, **kwargs):
+    remove_from_index(kind_of(instance), [instance.pk])
+    ExtractedText.objects.filter(kind=kind_of(instance), object_id=instance.pk).delete()
 
+@receiver(post_save, sender=Lesson)
+@receiver(post_save, sender=Test)
 @receiver(post_save, sender=Resource)
-def notify_resource_approval(sender, instance, created, **kwargs):
-    if not created and instance.is_approved:
-        Notification.objects.create(
-            recipient=instance.author,
-            title="Resource Approved",
-            message=f"Your resource '{instance.title}' has been approved.",
-            link="/content/library/"
-        )
-
-@receiver(post_save, sender=Announcement)
-def notify_announcement(sender, instance, created, **kwargs):
+def extract_attachment(sender, instance, created, **kwargs):
+    # Reading a PDF is too slow for the upload request; the job indexes its
+    # text afterwards, and drops text extracted from a file that was removed
+    name = 'file' if sender is Resource else 'pdf_file'
+    if (created and getattr(instance, name)) or instance.has_changed(name):
+        enqueue(extract_attachment_text, kind=kind_of(instance), object_id=instance.pk)
+
+# Announcements need no per-user notification rows: they are broadcast and
+# merged into each user's notifications on read (see content.notifications).
+
+@receiver([post_save, post_delete], sender=Lesson)
+@receiver([post_save, post_delete], sender=Test)
+@receiver([post_save, post_delete], sender=Resource)
+@receiver([post_save, post_delete], sender=Announcement)
+def bump_content_version(sender, using, **kwargs):
+    # Invalidates list page ETags once the write is visible
+    name = sender._meta.model_name
+    transaction.on_commit(lambda: bump_version(name), using=using)
+
+@receiver([post_save, post_delete], sender=Question)
+def bump_question_version(sender, instance, using, **kwargs):
+    # Invalidates the test's cached questions and answer key
+    name = question_version_name(instance.test_id)
+    transaction.on_commit(lambda: bump_version(name), using=using)
+
+@receiver([post_save, post_delete], sender=Notification)
+def bump_notification_version(sender, instance, using, **kwargs):
+    name = f'notifications:{instance.recipient_id}'
+    transaction.on_commit(lambda: bump_version(name), using=using)
+
+@receiver(post_save, sender=ChatMessage)
+def publish_chat_message(sender, instance, created, using, **kwargs):
+    room = (instance.year, instance.stream)
     if created:
-        User = get_user_model()
-        # Notify all active users (students AND teachers)
-        recipients = User.objects.filter(is_active=True)
-        notifications = []
-        for user in recipients:
-            notifications.append(Notification(
-                recipient=user,
-                announcement=instance,
-                title="New Announcement",
-                message=f"New announcement: {instance.title}",
-                link="/"
-            ))
-        Notification.objects.bulk_create(notifications)
+        kind = ChatChange.CREATE
+    elif instance.is_removed:
+        kind = ChatChange.REMOVE
+    else:
+        kind = ChatChange.EDIT
+    change = ChatChange.objects.using(using).create(message=instance, year=instance.year, stream=instance.stream, kind=kind)
+
+    entry = message_entry(instance) if created and not instance.is_removed else None
+
+    def on_commit():
+        stamp = bump_version(room_version_name(instance.year, instance.stream))
+        if entry is not None:
+            recent_messages.append(room, entry, change.id, stamp)
+        else:
+            # Edits and removals change entries already in the buffer
+            recent_messages.invalidate(room)
+        # Wake up streaming and long-polling clients of the room once the write is visible
+        chat_broker.publish(room)
+
+    transaction.on_commit(on_commit, using=using)
+
+@receiver(pre_delete, sender=settings.AUTH_USER_MODEL)
+def delete_user_chat_messages_on_delete(sender, instance, **kwargs):
+    # Chat may live in its own database, out of the deletion collector's
+    # reach, so a user's messages are removed by a job rather than by cascade.
+    enqueue(delete_user_chat_messages, user_id=instance.pk)
 
 @receiver(post_save, sender=Lesson)
+@receiver(post_save, sender=Test)
+@receiver(post_save, sender=Resource)
 def auto_delete_file_on_change(sender, instance, **kwargs):
     """
-    Deletes old file from filesystem when corresponding `MediaFile` object is updated
-    with new file.
+    Deletes the old file from storage when the object is saved with a new one.
     """
-    if not instance.pk:
-        return False
-
-    try:
-        old_file = Lesson.objects.get(pk=instance.pk).pdf_file
-    except Lesson.DoesNotExist:
-        return False
-
-    new_file = instance.pdf_file
-    if not old_file == new_file:
-        if old_file:
-            old_file.delete(save=False)
+    name = 'file' if sender is Resource else 'pdf_file'
+    old_file = instance.previous_value(name)
+    if old_file and instance.has_changed(name):
+        enqueue(delete_files, name=old_file)
 
 @receiver(post_delete, sender=Lesson)
 def auto_delete_file_on_delete_lesson(sender, instance, **kwargs):
@@ -77,14 +120,14 @@ def auto_delete_file_on_delete_lesson(sender, instance, **kwargs):
     Deletes file from filesystem when corresponding `Lesson` object is deleted.
     """
     if instance.pdf_file:
-        instance.pdf_file.delete(save=False)
+        enqueue(delete_files, name=instance.pdf_file.name)
 
 @receiver(post_delete, sender=Test)
 def auto_delete_file_on_delete_test(sender, instance, **kwargs):
     if instance.pdf_file:
-        instance.pdf_file.delete(save=False)
+        enqueue(delete_files, name=instance.pdf_file.name)
 
 @receiver(post_delete, sender=Resource)
 def auto_delete_file_on_delete_resource(sender, instance, **kwargs):
     if instance.file:
-        instance.file.delete(save=False)
+        enqueue(delete_files, name=instance.file.name)
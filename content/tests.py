@@ -1,7 +1,72 @@
-from django.test import TestCase, Client
+import asyncio
+import json
+import shutil
+import tempfile
+import threading
+from contextlib import ExitStack
+from io import StringIO
+from unittest import mock, skipUnless
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import CommandError, call_command
+from django.db import connection, connections, router
+from django.test import TestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 from django.urls import reverse
-from users.models import CustomUser
-from .models import Lesson, Test, Question
+from users.models import CustomUser, YEAR_CHOICES, STREAM_CHOICES
+from core.ratelimit import take_token
+from core.versions import bump_version, get_version
+from jobs.queue import run_pending
+from moderation.models import Report
+from .chat import ChatBroker, fetch_changes, fetch_entries, recent_messages
+from .models import Lesson, Test, Question, ChatMessage, ChatChange, ChatArchive, Announcement, Notification, Resource, SearchDocument, ExtractedText, Result, StudentAnswer
+from .notifications import notification_page, unread_notification_count
+from .routers import ChatRouter
+from .analysis import normalize, tokenize
+from .autocomplete import SEARCH_VERSION, title_index
+from .extraction import extract_pdf_text
+from .search import cached_search, highlight, search, search_cache_stats, snippet
+
+try:
+    import pypdf
+except ImportError:
+    pypdf = None
+
+CHAT_DB = router.db_for_write(ChatMessage)
+
+
+def create_user(username, **fields):
+    """An active user; CustomUser.save makes new non-superusers inactive until approved."""
+    user = CustomUser.objects.create_user(username=username, password='password', **fields)
+    CustomUser.objects.filter(pk=user.pk).update(is_active=True)
+    user.is_active = True
+    return user
+
+
+def create_teacher(username='teacher', **fields):
+    return create_user(username, is_teacher=True, **fields)
+
+
+def create_student(username='student', **fields):
+    return create_user(username, is_student=True, **fields)
+
+
+def create_chatter(username='chatter', **fields):
+    """A student of the year 1 math chat room."""
+    return create_student(username, year=1, stream='math', **fields)
+
+
+class ContentTestCase(TestCase):
+    """Starts every test without the cached and in-memory state earlier tests left behind."""
+
+    def setUp(self):
+        cache.clear()
+        recent_messages.clear()
+        title_index.clear()
 
 class ContentTests(TestCase):
     def setUp(self):
@@ -110,3 +175,1258 @@ class ContentTests(TestCase):
         response = self.client.get(reverse('home'))
         self.assertContains(response, f'href="{reverse("teacher_dashboard")}"')
         self.assertContains(response, 'Teacher') # Checking for badge text
+
+
+class ChatLiveUpdateTests(ContentTestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        super().setUp()
+        self.student = create_chatter()
+        self.client.force_login(self.student)
+
+    def test_poll_returns_existing_messages_immediately(self):
+        msg = ChatMessage.objects.create(author=self.student, year=1, stream='math', message='Hello')
+        response = self.client.get(reverse('poll_messages', args=[1, 'math']), {'since': 0})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([m['id'] for m in response.json()['messages']], [msg.id])
+
+    @override_settings(CHAT_LONG_POLL_TIMEOUT=0.01)
+    def test_poll_times_out_without_new_messages(self):
+        ChatMessage.objects.create(author=self.student, year=1, stream='math', message='Hello')
+        version = ChatChange.objects.get().id
+        response = self.client.get(reverse('poll_messages', args=[1, 'math']), {'since': version})
+        self.assertEqual(response.json()['version'], version)
+        self.assertEqual(response.json()['messages'], [])
+
+    def test_poll_rejects_other_rooms(self):
+        response = self.client.get(reverse('poll_messages', args=[2, 'science']), {'since': 0})
+        self.assertEqual(response.status_code, 403)
+
+    def test_events_require_asgi(self):
+        response = self.client.get(reverse('chat_events', args=[1, 'math']))
+        self.assertEqual(response.status_code, 501)
+
+    def post(self, text):
+        # Publishes to the room once committed, like a message sent by the view
+        with self.captureOnCommitCallbacks(using=CHAT_DB, execute=True):
+            return ChatMessage.objects.create(author=self.student, year=1, stream='math', message=text)
+
+    @override_settings(CHAT_STREAM_KEEPALIVE=30)
+    async def test_events_stream_deltas_as_messages_are_posted(self):
+        await self.async_client.aforce_login(self.student)
+        response = await self.async_client.get(reverse('chat_events', args=[1, 'math']), {'since': 0})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = aiter(response.streaming_content)
+        self.assertIn(b'event: ready', await anext(events))
+
+        msg = await sync_to_async(self.post)('Hello')
+        event = (await asyncio.wait_for(anext(events), 5)).decode()
+        fields = dict(line.split(': ', 1) for line in event.strip().split('\n'))
+        delta = json.loads(fields['data'])
+        self.assertEqual(fields['event'], 'delta')
+        self.assertEqual(int(fields['id']), delta['version'])
+        self.assertEqual([m['id'] for m in delta['messages']], [msg.id])
+        await events.aclose()
+
+    @override_settings(CHAT_LONG_POLL_TIMEOUT=30)
+    async def test_pending_poll_returns_when_a_message_is_published(self):
+        await self.async_client.aforce_login(self.student)
+        poll = asyncio.ensure_future(self.async_client.get(reverse('poll_messages', args=[1, 'math']), {'since': 0}))
+        await asyncio.sleep(0.05)
+        self.assertFalse(poll.done())
+
+        msg = await sync_to_async(self.post)('Hello')
+        response = await asyncio.wait_for(poll, 5)
+        self.assertEqual([m['id'] for m in response.json()['messages']], [msg.id])
+
+    def test_broker_wakes_waiters_on_publish(self):
+        broker = ChatBroker()
+        room = (1, 'math')
+
+        async def wait_for_publish():
+            version = broker.version(room)
+            waiter = asyncio.ensure_future(broker.wait(room, version, timeout=5))
+            await asyncio.sleep(0)
+            threading.Thread(target=broker.publish, args=(room,)).start()
+            return await waiter
+
+        self.assertTrue(async_to_sync(wait_for_publish)())
+        self.assertEqual(broker.version(room), 1)
+        self.assertFalse(async_to_sync(broker.wait)(room, 1, timeout=0.01))
+
+
+@override_settings(CHAT_PAGE_SIZE=2)
+class ChatBufferTests(ContentTestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        super().setUp()
+        self.student = create_chatter()
+        self.client.force_login(self.student)
+
+    def send(self, text):
+        with self.captureOnCommitCallbacks(using=CHAT_DB, execute=True):
+            response = self.client.post(
+                reverse('send_message', args=[1, 'math']), {'message': text},
+                HTTP_X_REQUESTED_WITH='XMLHttpRequest'
+            )
+        return response.json()['message']['id']
+
+    def test_reads_are_served_from_memory_once_warm(self):
+        first = self.send('one')
+        fetch_entries(self.student, 1, 'math')
+        second = self.send('two')
+        third = self.send('three')
+
+        with self.assertNumQueries(0):
+            latest, version = fetch_entries(self.student, 1, 'math')
+            newer, _ = fetch_entries(self.student, 1, 'math', last_id=first)
+        self.assertEqual([m['id'] for m in latest], [second, third])
+        self.assertEqual([m['id'] for m in newer], [second, third])
+        self.assertEqual(version, ChatChange.objects.latest('id').id)
+
+    def test_edit_and_removal_invalidate_the_room(self):
+        msg_id = self.send('typo')
+        fetch_entries(self.student, 1, 'math')
+
+        with self.captureOnCommitCallbacks(using=CHAT_DB, execute=True):
+            self.client.post(reverse('edit_chat_message', args=[msg_id]), {'message': 'fixed'})
+        self.assertEqual(fetch_entries(self.student, 1, 'math')[0][0]['text'], 'fixed')
+
+        with self.captureOnCommitCallbacks(using=CHAT_DB, execute=True):
+            self.client.post(reverse('delete_chat_message', args=[msg_id]))
+        self.assertEqual(fetch_entries(self.student, 1, 'math')[0], [])
+
+
+@override_settings(CHAT_PAGE_SIZE=2, CHAT_HISTORY_MAX_PAGE=3)
+class ChatHistoryTests(ContentTestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        super().setUp()
+        self.student = create_chatter()
+        self.client.force_login(self.student)
+        self.ids = [
+            ChatMessage.objects.create(author=self.student, year=1, stream='math', message=f'm{i}').id
+            for i in range(7)
+        ]
+
+    def history(self, **params):
+        return self.client.get(reverse('chat_history', args=[1, 'math']), params).json()
+
+    def test_walks_back_through_the_room(self):
+        first = self.client.get(reverse('get_messages', args=[1, 'math'])).json()
+        self.assertEqual([m['id'] for m in first['messages']], self.ids[-2:])
+
+        page = self.history(before=first['before'], limit=10)
+        self.assertEqual([m['id'] for m in page['messages']], self.ids[2:5])
+        page = self.history(before=page['before'], limit=10)
+        self.assertEqual([m['id'] for m in page['messages']], self.ids[:2])
+        self.assertIsNone(page['before'])
+
+    def test_after_cursor_returns_newer_messages(self):
+        page = self.history(limit=1)
+        self.assertEqual([m['id'] for m in page['messages']], self.ids[-1:])
+        older = self.history(before=page['before'], limit=1)
+        newer = self.history(after=older['after'], limit=3)
+        self.assertEqual([m['id'] for m in newer['messages']], self.ids[-1:])
+
+    def test_rejects_malformed_cursor(self):
+        response = self.client.get(reverse('chat_history', args=[1, 'math']), {'before': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_catch_up_from_old_last_id_is_bounded(self):
+        # With a buffer smaller than the backlog the catch-up comes from the database
+        with mock.patch.object(recent_messages, 'size', 2):
+            older, _ = fetch_entries(self.student, 1, 'math', last_id=self.ids[0])
+        self.assertEqual([m['id'] for m in older], self.ids[1:4])
+
+
+class ChatSyncTests(ContentTestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        super().setUp()
+        self.student = create_chatter()
+        self.client.force_login(self.student)
+        self.other = create_chatter('other')
+
+    def test_delta_carries_inserts_edits_and_removals(self):
+        edited = ChatMessage.objects.create(author=self.student, year=1, stream='math', message='draft')
+        removed = ChatMessage.objects.create(author=self.other, year=1, stream='math', message='oops')
+        version = self.client.get(reverse('get_messages', args=[1, 'math'])).json()['version']
+
+        edited.message = 'final'
+        edited.save()
+        removed.is_removed = True
+        removed.save()
+        new = ChatMessage.objects.create(author=self.other, year=1, stream='math', message='hi')
+
+        delta = self.client.get(reverse('get_messages', args=[1, 'math']), {'since': version}).json()
+        self.assertEqual([m['id'] for m in delta['messages']], [new.id])
+        self.assertEqual([(m['id'], m['text']) for m in delta['edited']], [(edited.id, 'final')])
+        self.assertEqual(delta['removed'], [removed.id])
+        self.assertEqual(delta['version'], ChatChange.objects.latest('id').id)
+        self.assertFalse(delta['has_more'])
+
+    def test_message_created_and_edited_in_one_delta_is_an_insert(self):
+        msg = ChatMessage.objects.create(author=self.student, year=1, stream='math', message='draft')
+        msg.message = 'final'
+        msg.save()
+        delta = fetch_changes(self.student, 1, 'math', 0)
+        self.assertEqual([m['text'] for m in delta['messages']], ['final'])
+        self.assertEqual(delta['edited'], [])
+
+    def test_rooms_have_separate_change_streams(self):
+        ChatMessage.objects.create(author=self.student, year=2, stream='science', message='elsewhere')
+        delta = fetch_changes(self.student, 1, 'math', 0)
+        self.assertEqual(delta['version'], 0)
+        self.assertEqual(delta['messages'], [])
+
+
+class ChatQueryCountTests(ContentTestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        super().setUp()
+        self.student = create_chatter()
+        self.client.force_login(self.student)
+
+    def add_messages(self, count):
+        authors = [
+            CustomUser.objects.create_user(username=f'author{ChatMessage.objects.count()}_{i}', password='password')
+            for i in range(count)
+        ]
+        for author in authors:
+            msg = ChatMessage.objects.create(author=author, year=1, stream='math', message='hi')
+            msg.message = 'edited'
+            msg.save()
+
+    def count_queries(self, *requests):
+        recent_messages.clear()
+        # Chat may live in its own database; count the queries of every one
+        with ExitStack() as stack:
+            contexts = [stack.enter_context(CaptureQueriesContext(db)) for db in connections.all()]
+            for params in requests:
+                response = self.client.get(reverse('get_messages', args=[1, 'math']), params)
+                self.assertEqual(response.status_code, 200)
+            response = self.client.get(reverse('chat_history', args=[1, 'math']), {'limit': 100})
+            self.assertEqual(response.status_code, 200)
+        return {db.alias: len(context.captured_queries) for db, context in zip(connections.all(), contexts)}
+
+    def test_read_path_query_count_is_independent_of_message_count(self):
+        requests = [{}, {'since': 0}]
+        self.add_messages(2)
+        few = self.count_queries(*requests)
+        self.add_messages(20)
+        many = self.count_queries(*requests)
+        self.assertEqual(few, many)
+        self.assertGreater(few[CHAT_DB], 0)
+
+
+class ConditionalGetTests(ContentTestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        super().setUp()
+        self.teacher = create_teacher()
+        self.student = create_chatter()
+        self.client.force_login(self.student)
+
+    def revalidate(self, url, params=None):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return self.client.get(url, params, HTTP_IF_NONE_MATCH=response['ETag'])
+
+    def test_unchanged_chat_poll_is_not_modified_without_chat_queries(self):
+        url = reverse('get_messages', args=[1, 'math'])
+        ChatMessage.objects.create(author=self.student, year=1, stream='math', message='Hello')
+        etag = self.client.get(url, {'since': 0})['ETag']
+
+        with CaptureQueriesContext(connections[CHAT_DB]) as context:
+            response = self.client.get(url, {'since': 0}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse([q for q in context.captured_queries if 'content_chat' in q['sql']])
+
+        with self.captureOnCommitCallbacks(using=CHAT_DB, execute=True):
+            ChatMessage.objects.create(author=self.student, year=1, stream='math', message='Again')
+        response = self.client.get(url, {'since': 0}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['messages']), 2)
+
+    def test_list_pages_are_not_modified_until_their_model_changes(self):
+        # The first visit sets the CSRF cookie the ETag depends on
+        self.client.get(reverse('test_list'))
+        self.assertEqual(self.revalidate(reverse('test_list')).status_code, 304)
+        self.assertEqual(self.revalidate(reverse('resource_list')).status_code, 304)
+        self.assertEqual(self.revalidate(reverse('lesson_list'), {'year': 1}).status_code, 304)
+
+        etag = self.client.get(reverse('test_list'))['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            Test.objects.create(title='New', author=self.teacher, is_approved=True)
+        response = self.client.get(reverse('test_list'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'New')
+
+
+class ChatRouterTests(TestCase):
+    def setUp(self):
+        self.router = ChatRouter()
+
+    def test_single_database_layout_routes_nothing(self):
+        with mock.patch.object(ChatRouter, 'enabled', return_value=False):
+            self.assertIsNone(self.router.db_for_write(ChatMessage))
+            self.assertIsNone(self.router.db_for_read(CustomUser))
+            self.assertIsNone(self.router.allow_migrate('default', 'content', 'chatmessage'))
+
+    def test_split_layout_routes_chat_tables(self):
+        msg = ChatMessage(id=1)
+        with mock.patch.object(ChatRouter, 'enabled', return_value=True):
+            self.assertEqual(self.router.db_for_write(ChatMessage), 'chat')
+            self.assertEqual(self.router.db_for_read(ChatChange), 'chat')
+            self.assertIsNone(self.router.db_for_read(Lesson))
+            # Following msg.author must leave the chat database
+            self.assertEqual(self.router.db_for_read(CustomUser, instance=msg), 'default')
+            self.assertTrue(self.router.allow_relation(msg, CustomUser()))
+
+    def test_split_layout_migrates_chat_tables_only_in_chat_database(self):
+        with mock.patch.object(ChatRouter, 'enabled', return_value=True):
+            self.assertTrue(self.router.allow_migrate('chat', 'content', 'chatmessage'))
+            self.assertFalse(self.router.allow_migrate('chat', 'content', 'lesson'))
+            self.assertFalse(self.router.allow_migrate('chat', 'users', 'customuser'))
+            self.assertFalse(self.router.allow_migrate('default', 'content', 'chatchange'))
+            self.assertIsNone(self.router.allow_migrate('default', 'content', 'lesson'))
+
+
+class ChatDatabaseLayoutTests(ContentTestCase):
+    """Runs against whichever layout is configured; set SEPARATE_CHAT_DB=True to cover the split one."""
+    databases = '__all__'
+
+    def setUp(self):
+        super().setUp()
+        self.student = create_chatter(nickname='Chatty')
+        self.teacher = create_teacher()
+        self.client.force_login(self.student)
+
+    def test_send_and_read_messages(self):
+        with self.captureOnCommitCallbacks(using=CHAT_DB, execute=True):
+            self.client.post(reverse('send_message', args=[1, 'math']), {'message': 'hello'}, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(ChatMessage.objects.using(CHAT_DB).count(), 1)
+        self.assertEqual(ChatChange.objects.using(CHAT_DB).count(), 1)
+
+        recent_messages.clear()
+        messages = self.client.get(reverse('get_messages', args=[1, 'math'])).json()['messages']
+        self.assertEqual([(m['author'], m['text']) for m in messages], [('Chatty', 'hello')])
+        history = self.client.get(reverse('chat_history', args=[1, 'math'])).json()['messages']
+        self.assertEqual([m['author'] for m in history], ['Chatty'])
+
+    def test_deleting_user_deletes_their_messages(self):
+        ChatMessage.objects.create(author=self.student, year=1, stream='math', message='bye')
+        self.student.delete()
+        run_pending()
+        self.assertFalse(ChatMessage.objects.exists())
+        self.assertFalse(ChatChange.objects.exists())
+
+    def test_reported_message_can_be_hidden(self):
+        msg = ChatMessage.objects.create(author=self.student, year=1, stream='math', message='spam')
+        report = Report.objects.create(
+            reporter=self.teacher, content_type=ContentType.objects.get_for_model(ChatMessage),
+            object_id=msg.id, reason='spam'
+        )
+        self.assertEqual(report.target, msg)
+        self.client.force_login(self.teacher)
+        self.client.post(reverse('moderation:report_action', args=[report.id]), {'action': 'hide'})
+        msg.refresh_from_db()
+        self.assertTrue(msg.is_removed)
+
+
+class ChatBenchmarkCommandTests(TestCase):
+    databases = '__all__'
+
+    def test_reports_every_room_and_cleans_up(self):
+        out = StringIO()
+        call_command('bench_chat', users_per_room=1, requests=3, concurrency=1, send_ratio=0.5, seed=1, json=True, stdout=out)
+        report = json.loads(out.getvalue())
+
+        rooms = len(YEAR_CHOICES) * len(STREAM_CHOICES)
+        self.assertEqual(report['rooms'], rooms)
+        self.assertEqual(report['all']['requests'], rooms * 3)
+        self.assertEqual(report['all']['errors'], 0)
+        self.assertEqual(report['get']['requests'] + report['send']['requests'], rooms * 3)
+        self.assertGreater(report['all']['queries_per_request'], 0)
+        self.assertFalse(CustomUser.objects.filter(username__startswith='bench_').exists())
+        self.assertFalse(ChatMessage.objects.exists())
+
+
+@override_settings(CHAT_SEND_BURST=2, CHAT_SEND_PER_MINUTE=60)
+class ChatRateLimitTests(ContentTestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        super().setUp()
+        self.student = create_chatter()
+        self.client.force_login(self.student)
+
+    def send(self, stream='math'):
+        return self.client.post(
+            reverse('send_message', args=[1, stream]), {'message': 'spam'},
+            HTTP_X_REQUESTED_WITH='XMLHttpRequest'
+        )
+
+    def test_burst_then_structured_429(self):
+        self.assertEqual(self.send().status_code, 200)
+        self.assertEqual(self.send().status_code, 200)
+        response = self.send()
+        self.assertEqual(response.status_code, 429)
+        data = response.json()
+        self.assertFalse(data['success'])
+        self.assertEqual(data['code'], 'rate_limited')
+        self.assertEqual(data['retry_after'], 1)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertEqual(ChatMessage.objects.count(), 2)
+
+    def test_buckets_are_per_room(self):
+        self.student.is_teacher = True
+        self.student.save()
+        self.send()
+        self.send()
+        self.assertEqual(self.send('science').status_code, 200)
+
+    def test_bucket_refills_without_queries(self):
+        with mock.patch('core.ratelimit.time.time', return_value=1000.0), self.assertNumQueries(0):
+            self.assertTrue(take_token('test', 2, 1)[0])
+            self.assertTrue(take_token('test', 2, 1)[0])
+            allowed, retry_after = take_token('test', 2, 1)
+        self.assertFalse(allowed)
+        self.assertAlmostEqual(retry_after, 1)
+        with mock.patch('core.ratelimit.time.time', return_value=1001.5):
+            self.assertTrue(take_token('test', 2, 1)[0])
+            self.assertFalse(take_token('test', 2, 1)[0])
+
+
+@override_settings(CHAT_PAGE_SIZE=2)
+class ChatArchiveTests(ContentTestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        super().setUp()
+        self.student = create_chatter()
+        self.client.force_login(self.student)
+
+        long_ago = timezone.now() - timezone.timedelta(days=400)
+        self.old = []
+        for i, text in enumerate(['first', 'second', 'third']):
+            msg = ChatMessage.objects.create(author=self.student, year=1, stream='math', message=text)
+            ChatMessage.objects.filter(pk=msg.pk).update(created_at=long_ago + timezone.timedelta(days=i * 40))
+            self.old.append(msg.pk)
+        hidden = ChatMessage.objects.create(author=self.student, year=1, stream='math', message='hidden', is_removed=True)
+        ChatMessage.objects.filter(pk=hidden.pk).update(created_at=long_ago)
+        self.recent = ChatMessage.objects.create(author=self.student, year=1, stream='math', message='recent')
+
+    def archive(self):
+        call_command('archive_chat', days=30, batch_size=2, stdout=StringIO())
+
+    def history(self, **params):
+        return self.client.get(reverse('chat_history', args=[1, 'math']), params).json()
+
+    def test_moves_old_messages_into_monthly_archives(self):
+        self.archive()
+        self.assertEqual(list(ChatMessage.objects.values_list('id', flat=True)), [self.recent.pk])
+        self.assertEqual(ChatArchive.objects.filter(year=1, stream='math').count(), 3)
+        self.assertEqual(sum(ChatArchive.objects.values_list('message_count', flat=True)), 3)
+
+        # Running again archives nothing twice
+        self.archive()
+        self.assertEqual(sum(ChatArchive.objects.values_list('message_count', flat=True)), 3)
+
+    def test_each_month_is_compressed_and_written_once(self):
+        first = ChatMessage.objects.get(pk=self.old[0])
+        for i in range(4):
+            msg = ChatMessage.objects.create(author=self.student, year=1, stream='math', message=f'more {i}')
+            ChatMessage.objects.filter(pk=msg.pk).update(created_at=first.created_at)
+        with CaptureQueriesContext(connections[CHAT_DB]) as context:
+            self.archive()
+        writes = [query['sql'] for query in context.captured_queries if query['sql'].startswith(('INSERT INTO "content_chatarchive"', 'UPDATE "content_chatarchive"'))]
+        self.assertEqual(len(writes), 3)
+        self.assertEqual(sorted(ChatArchive.objects.values_list('message_count', flat=True)), [1, 1, 5])
+
+    def test_ids_keep_increasing_after_everything_is_archived(self):
+        ChatMessage.objects.filter(pk=self.recent.pk).update(created_at=timezone.now() - timezone.timedelta(days=60))
+        self.archive()
+        self.assertFalse(ChatMessage.objects.exists())
+        message = ChatMessage.objects.create(author=self.student, year=1, stream='math', message='new')
+        self.assertGreater(message.pk, self.recent.pk)
+
+    def test_history_continues_into_archives(self):
+        self.archive()
+        page = self.history()
+        self.assertEqual([m['text'] for m in page['messages']], ['third', 'recent'])
+        page = self.history(before=page['before'])
+        self.assertEqual([m['text'] for m in page['messages']], ['first', 'second'])
+        self.assertIsNone(page['before'])
+
+        newer = self.history(after=page['after'])
+        self.assertEqual([m['text'] for m in newer['messages']], ['third', 'recent'])
+
+    def test_archived_history_respects_cleared_chat(self):
+        self.archive()
+        self.student.last_chat_clear_time = timezone.now() - timezone.timedelta(days=380)
+        self.student.save()
+        page = self.history(limit=10)
+        self.assertEqual([m['text'] for m in page['messages']], ['second', 'third', 'recent'])
+
+
+class AnnouncementBroadcastTests(ContentTestCase):
+    def setUp(self):
+        super().setUp()
+        self.teacher = create_teacher()
+        self.student = create_student()
+        self.client.force_login(self.student)
+
+    def announce(self, title):
+        return Announcement.objects.create(title=title, content='...', author=self.teacher)
+
+    def test_posting_does_not_write_a_row_per_user(self):
+        for i in range(5):
+            CustomUser.objects.create_user(username=f'student{i}', password='password', is_student=True)
+        CustomUser.objects.update(is_active=True)
+        with self.assertNumQueries(1):
+            self.announce('Exam dates')
+        self.assertFalse(Notification.objects.exists())
+
+    def test_list_merges_personal_and_broadcast_notifications(self):
+        first = self.announce('Exam dates')
+        Notification.objects.create(recipient=self.student, title='Lesson Approved', message='...')
+        self.announce('Holiday')
+        self.assertEqual(unread_notification_count(self.student), 3)
+
+        response = self.client.get(reverse('notification_list'))
+        self.assertEqual(
+            [n.title for n in response.context['notifications']],
+            ['New Announcement', 'Lesson Approved', 'New Announcement']
+        )
+        self.assertEqual(response.context['notifications'][2].pk, first.pk)
+        self.assertEqual(response.context['unread_count'], 3)
+
+    def test_marking_an_announcement_read_moves_the_watermark(self):
+        older = self.announce('Exam dates')
+        newer = self.announce('Holiday')
+        self.client.get(reverse('mark_announcement_read', args=[older.pk]))
+        self.student.refresh_from_db()
+        self.assertEqual(self.student.announcements_seen_at, older.created_at)
+        self.assertEqual(unread_notification_count(self.student), 1)
+
+        self.client.get(reverse('mark_announcement_read', args=[newer.pk]))
+        # Reading an older one again never moves it back
+        self.client.get(reverse('mark_announcement_read', args=[older.pk]))
+        self.student.refresh_from_db()
+        self.assertEqual(unread_notification_count(self.student), 0)
+
+    def test_new_users_only_get_later_announcements(self):
+        self.announce('Before')
+        newcomer = CustomUser.objects.create_user(username='newcomer', password='password', is_student=True)
+        self.assertEqual(unread_notification_count(newcomer), 0)
+        self.announce('After')
+        self.assertEqual(unread_notification_count(newcomer), 1)
+
+    def test_removed_announcements_disappear(self):
+        announcement = self.announce('Oops')
+        announcement.is_removed = True
+        announcement.save()
+        self.assertEqual(unread_notification_count(self.student), 0)
+
+
+class NotificationBadgeTests(ContentTestCase):
+    def setUp(self):
+        super().setUp()
+        self.teacher = create_teacher()
+        self.student = create_student()
+        self.client.force_login(self.student)
+
+    def badge(self):
+        response = self.client.get(reverse('lesson_list'))
+        return response.context['unread_notification_count']()
+
+    def test_navbar_runs_no_notification_queries_once_cached(self):
+        Notification.objects.create(recipient=self.student, title='Hi', message='...')
+        self.client.get(reverse('lesson_list'))
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('lesson_list'))
+        self.assertContains(response, 'background: var(--danger)')
+        self.assertFalse([
+            q for q in context.captured_queries
+            if 'content_notification' in q['sql'] or 'content_announcement' in q['sql']
+        ])
+
+    def test_count_follows_creates_reads_and_removals(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            first = Notification.objects.create(recipient=self.student, title='One', message='...')
+            Notification.objects.create(recipient=self.student, title='Two', message='...')
+            Notification.objects.create(recipient=self.teacher, title='Other', message='...')
+        self.assertEqual(self.badge(), 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.get(reverse('mark_notification_read', args=[first.pk]))
+        self.assertEqual(self.badge(), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Notification.objects.filter(recipient=self.student, is_read=False).get().delete()
+        self.assertEqual(self.badge(), 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Announcement.objects.create(title='News', content='...', author=self.teacher)
+        self.assertEqual(self.badge(), 1)
+
+
+class NotificationInboxTests(ContentTestCase):
+    def setUp(self):
+        super().setUp()
+        self.teacher = create_teacher()
+        self.student = create_student()
+        self.client.force_login(self.student)
+
+    def notify(self, title):
+        return Notification.objects.create(recipient=self.student, title=title, message='...')
+
+    def announce(self, title):
+        return Announcement.objects.create(title=title, content='...', author=self.teacher)
+
+    def test_pages_walk_both_sources_without_gaps(self):
+        for i in range(4):
+            self.notify(f'Personal {i}')
+            self.announce(f'Announcement {i}')
+        # Ties on the timestamp are broken by source, then id
+        tie = timezone.now()
+        Notification.objects.filter(title__in=['Personal 1', 'Personal 2']).update(created_at=tie)
+        Announcement.objects.filter(title='Announcement 1').update(created_at=tie)
+        expected = [n.pk for n in notification_page(self.student, limit=100)[0]]
+        self.assertEqual(len(expected), 8)
+
+        seen, cursor = [], None
+        while True:
+            with self.assertNumQueries(2):
+                page, cursor = notification_page(self.student, cursor, limit=3)
+            seen += [n.pk for n in page]
+            if cursor is None:
+                break
+        self.assertEqual(seen, expected)
+
+    @override_settings(NOTIFICATIONS_PAGE_SIZE=2)
+    def test_list_links_to_older_pages(self):
+        for i in range(3):
+            self.notify(f'Personal {i}')
+        response = self.client.get(reverse('notification_list'))
+        self.assertEqual([n.title for n in response.context['notifications']], ['Personal 2', 'Personal 1'])
+        cursor = response.context['next_cursor']
+        response = self.client.get(reverse('notification_list'), {'before': cursor})
+        self.assertEqual([n.title for n in response.context['notifications']], ['Personal 0'])
+        self.assertIsNone(response.context['next_cursor'])
+
+        response = self.client.get(reverse('notification_list'), {'before': 'not-a-cursor'})
+        self.assertRedirects(response, reverse('notification_list'))
+
+    def test_mark_all_read(self):
+        for i in range(3):
+            self.notify(f'Personal {i}')
+        self.announce('News')
+        other = Notification.objects.create(recipient=self.teacher, title='Other', message='...')
+        self.assertEqual(self.client.get(reverse('notification_count')).json()['unread'], 4)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertNumQueries(5):
+                # Session and user, one UPDATE per source plus the newest announcement
+                self.client.post(reverse('mark_notifications_read'), {'all': '1'})
+        self.assertEqual(self.client.get(reverse('notification_count')).json()['unread'], 0)
+        other.refresh_from_db()
+        self.assertFalse(other.is_read)
+
+    def test_mark_selected_read(self):
+        first, second = self.notify('First'), self.notify('Second')
+        older, newer = self.announce('Older'), self.announce('Newer')
+        other = Notification.objects.create(recipient=self.teacher, title='Other', message='...')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse('mark_notifications_read'),
+                {'notification': [first.pk, other.pk], 'announcement': [older.pk]},
+                HTTP_X_REQUESTED_WITH='XMLHttpRequest'
+            )
+        self.assertEqual(response.json(), {'success': True, 'unread': 2})
+        self.assertEqual(
+            set(Notification.objects.filter(is_read=True).values_list('pk', flat=True)), {first.pk}
+        )
+        self.student.refresh_from_db()
+        page, _ = notification_page(self.student)
+        self.assertEqual([n.is_read for n in page], [False, True, False, True])
+        self.assertEqual([n.pk for n in page], [newer.pk, older.pk, second.pk, first.pk])
+
+
+class NotificationPurgeTests(ContentTestCase):
+    def setUp(self):
+        super().setUp()
+        self.student = create_student()
+
+    def notification(self, days_old, **fields):
+        notification = Notification.objects.create(recipient=self.student, title='Hi', message='...', **fields)
+        Notification.objects.filter(pk=notification.pk).update(created_at=timezone.now() - timezone.timedelta(days=days_old))
+        return notification.pk
+
+    def purge(self, **options):
+        out = StringIO()
+        options = {'days': 100, 'batch_size': 2, **options}
+        call_command('purge_notifications', stdout=out, **options)
+        return out.getvalue()
+
+    def test_purges_old_read_and_removed_notifications(self):
+        kept = [
+            self.notification(200),  # Unread
+            self.notification(50, is_read=True),
+        ]
+        for _ in range(3):
+            self.notification(200, is_read=True)
+        self.notification(200, is_removed=True)
+
+        output = self.purge(dry_run=True)
+        self.assertIn('4 notifications older than 100 days would be purged', output)
+        self.assertEqual(Notification.objects.count(), 6)
+
+        output = self.purge()
+        self.assertIn('Purged 4 notifications', output)
+        self.assertCountEqual(Notification.objects.values_list('pk', flat=True), kept)
+
+    def test_rejects_invalid_options(self):
+        with self.assertRaises(CommandError):
+            self.purge(batch_size=0)
+        with self.assertRaises(CommandError):
+            self.purge(days=0)
+
+
+class BulkModerationTests(ContentTestCase):
+    def setUp(self):
+        super().setUp()
+        self.admin = create_user('admin', is_staff=True)
+        self.teacher = create_teacher()
+        self.client.force_login(self.admin)
+
+    def act(self, item_type, action, items):
+        return self.client.post(reverse('dashboard:action'), {
+            'item_type': item_type, 'action': action, 'item_id': [item.pk for item in items]
+        })
+
+    def test_bulk_approval_sends_one_notification_per_item(self):
+        lessons = [Lesson.objects.create(title=f'Lesson {i}', content='...', author=self.teacher) for i in range(20)]
+        already = Lesson.objects.create(title='Old', content='...', author=self.teacher, is_approved=True)
+        with CaptureQueriesContext(connection) as context:
+            self.act('lesson', 'approve', lessons + [already])
+        writes = [q['sql'] for q in context.captured_queries if q['sql'].startswith(('UPDATE', 'INSERT'))]
+        # Approval, search documents and notifications
+        self.assertEqual(len(writes), 3)
+
+        self.assertEqual(Lesson.objects.filter(is_approved=True).count(), 21)
+        run_pending()
+        self.assertEqual(Notification.objects.filter(recipient=self.teacher, title='Lesson Approved').count(), 20)
+
+        # Approving again notifies nobody
+        self.act('lesson', 'approve', lessons)
+        run_pending()
+        self.assertEqual(Notification.objects.count(), 20)
+
+    def test_single_approval_is_not_notified_twice(self):
+        resource = Resource.objects.create(title='Sheet', type='link', author=self.teacher)
+        self.act('resource', 'approve', [resource])
+        run_pending()
+        self.assertEqual(Notification.objects.filter(recipient=self.teacher).count(), 1)
+
+    def test_bulk_reject_deletes_items(self):
+        tests = [Test.objects.create(title=f'Test {i}', author=self.teacher) for i in range(3)]
+        self.act('test', 'reject', tests[:2])
+        self.assertEqual(list(Test.objects.values_list('pk', flat=True)), [tests[2].pk])
+
+    def test_bulk_user_actions_skip_the_moderator(self):
+        students = [CustomUser.objects.create_user(username=f'student{i}', password='password', is_student=True) for i in range(3)]
+        with self.assertNumQueries(3):
+            # Session, moderator and one UPDATE
+            self.act('user', 'approve', students)
+        self.assertEqual(CustomUser.objects.filter(is_active=False).count(), 0)
+
+        self.act('user', 'deactivate', students + [self.admin])
+        self.assertEqual(set(CustomUser.objects.filter(is_active=True)), {self.admin, self.teacher})
+
+        self.act('user', 'reject', students[:2] + [self.admin])
+        self.assertEqual(CustomUser.objects.count(), 3)
+
+
+class SearchIndexTests(ContentTestCase):
+    def setUp(self):
+        super().setUp()
+        self.teacher = create_teacher()
+        self.student = create_student()
+        self.client.force_login(self.student)
+
+    def lesson(self, title, content, **fields):
+        return Lesson.objects.create(title=title, content=content, author=self.teacher, is_approved=True, **fields)
+
+    def results(self, query):
+        response = self.client.get(reverse('search'), {'q': query})
+        return [item.title for key in ('lessons', 'tests', 'resources') for item in response.context[key]]
+
+    def test_index_follows_approval_edits_and_removal(self):
+        lesson = Lesson.objects.create(title='Derivatives', content='<p>Limits and slopes</p>', author=self.teacher)
+        self.assertEqual(search('slopes'), [])
+
+        lesson.is_approved = True
+        lesson.save()
+        self.assertEqual([hit[:2] for hit in search('slop')], [('lesson', lesson.pk)])
+
+        lesson.content = 'Tangent lines'
+        lesson.save()
+        self.assertEqual(search('slopes'), [])
+        self.assertEqual(self.results('tangent'), ['Derivatives'])
+
+        lesson.is_removed = True
+        lesson.save()
+        self.assertEqual(self.results('tangent'), [])
+
+        Test.objects.create(title='Tangent quiz', author=self.teacher, is_approved=True).delete()
+        self.assertFalse(SearchDocument.objects.exists())
+
+    def test_title_matches_rank_first(self):
+        self.lesson('Algebra basics', 'A first look at vectors')
+        self.lesson('Vectors', 'Adding and scaling')
+        Test.objects.create(title='Geometry', description='Vectors in the plane', author=self.teacher, is_approved=True)
+        Resource.objects.create(title='Vector cheat sheet', type='link', author=self.teacher, is_approved=True)
+        self.assertEqual(self.results('vectors'), ['Vectors', 'Algebra basics', 'Geometry'])
+        self.assertEqual(self.results('vector'), ['Vectors', 'Algebra basics', 'Geometry', 'Vector cheat sheet'])
+        # FTS5 syntax typed by users is taken literally
+        self.assertEqual(self.results('vectors" OR "x'), [])
+
+    def test_dashboard_bulk_approval_is_indexed(self):
+        lesson = Lesson.objects.create(title='Optics', content='Lenses', author=self.teacher)
+        admin = CustomUser.objects.create_superuser(username='admin', password='password')
+        self.client.force_login(admin)
+        self.client.post(reverse('dashboard:action'), {'item_type': 'lesson', 'action': 'approve', 'item_id': [lesson.pk]})
+        self.assertEqual([hit[:2] for hit in search('lenses')], [('lesson', lesson.pk)])
+
+    def test_rebuild_command(self):
+        self.lesson('Waves', 'Sound and light')
+        Lesson.objects.create(title='Draft', content='Sound', author=self.teacher)
+        SearchDocument.objects.all().delete()
+        out = StringIO()
+        call_command('rebuild_search_index', batch_size=1, stdout=out)
+        self.assertIn('Indexed 1 lessons, 0 tests, 0 resources', out.getvalue())
+        self.assertEqual(len(search('sound')), 1)
+
+
+class ArabicSearchTests(ContentTestCase):
+    def setUp(self):
+        super().setUp()
+        self.teacher = create_teacher()
+
+    def test_normalization(self):
+        self.assertEqual(normalize('الْمَدْرَسَةُ'), 'المدرسه')
+        self.assertEqual(normalize('أحمد إلى آمن ٱلله'), 'احمد الي امن الله')
+        self.assertEqual(normalize('مـــسؤول رئيس'), 'مسوول رييس')
+        self.assertEqual(normalize('Élève ٢٠٢٤'), 'eleve 2024')
+
+    def test_light_stemming(self):
+        self.assertEqual(tokenize('والمعلمون في المدرسة'), ['معلم', 'في', 'مدرس'])
+        with self.settings(SEARCH_ARABIC_STEMMING=False):
+            self.assertEqual(tokenize('والمعلمون'), ['والمعلمون'])
+
+    def test_search_ignores_spelling_variants(self):
+        lesson = Lesson.objects.create(
+            title='الدَّرْسُ الأوَّل', content='مقدمة في الرياضيات للمدرسة', author=self.teacher, is_approved=True
+        )
+        for query in ['الدرس الاول', 'درس', 'المدرسه', 'رياضيات', 'مُقَدِّمَة']:
+            with self.subTest(query=query):
+                self.assertEqual([hit[:2] for hit in search(query)], [('lesson', lesson.pk)])
+
+
+class SearchResultsTests(ContentTestCase):
+    def setUp(self):
+        super().setUp()
+        self.teacher = create_teacher()
+
+    def get(self, **params):
+        return self.client.get(reverse('search'), params)
+
+    def test_highlighting_escapes_and_marks_matches(self):
+        self.assertEqual(
+            highlight('<b>Vectors</b> & vectorial', ['vector']),
+            '&lt;b&gt;<mark>Vectors</mark>&lt;/b&gt; &amp; <mark>vectorial</mark>'
+        )
+        self.assertEqual(highlight('الدَّرْسُ الأول', ['درس']), '<mark>الدَّرْسُ</mark> الأول')
+
+    def test_snippet_starts_near_the_first_match(self):
+        text = ' '.join(f'w{i}' for i in range(100)) + ' target ' + ' '.join(f'x{i}' for i in range(100))
+        self.assertEqual(
+            snippet(text, ['target'], length=8),
+            '… w98 w99 <mark>target</mark> x0 x1 x2 x3 x4 …'
+        )
+        self.assertEqual(snippet('Short text', ['none']), 'Short text')
+
+    @override_settings(SEARCH_RESULTS_PER_PAGE=2)
+    def test_results_are_ranked_and_paged_per_kind(self):
+        for i in range(5):
+            Lesson.objects.create(title=f'Lesson {i}', content=f'About optics {i}', author=self.teacher, is_approved=True)
+        best = Lesson.objects.create(title='Optics', content='Lenses', author=self.teacher, is_approved=True)
+        test = Test.objects.create(title='Optics quiz', author=self.teacher, is_approved=True)
+        for i in range(3):
+            Question.objects.create(
+                test=test, text=f'Q{i}', option_a='a', option_b='b', option_c='c', option_d='d', correct_option='A'
+            )
+
+        with self.assertNumQueries(3):
+            # The search, then one page of lessons and of tests; no resource matched
+            response = self.get(q='optics')
+        lessons = response.context['lessons']
+        self.assertEqual(lessons.paginator.count, 6)
+        self.assertEqual(lessons[0].pk, best.pk)
+        self.assertEqual(len(lessons), 2)
+        self.assertContains(response, '<mark>Optics</mark> quiz')
+        self.assertContains(response, '3 Questions')
+
+        response = self.get(q='optics', lesson_page=3, test_page=1)
+        self.assertEqual(response.context['lessons'].number, 3)
+        self.assertEqual(response.context['lessons'].previous_url, '?q=optics&lesson_page=2&test_page=1')
+        self.assertEqual(response.context['tests'].number, 1)
+
+
+class AutocompleteTests(ContentTestCase):
+    def setUp(self):
+        super().setUp()
+        self.teacher = create_teacher()
+
+    def lesson(self, title, **fields):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Lesson.objects.create(title=title, content='...', author=self.teacher, is_approved=True, **fields)
+
+    def titles(self, query, limit=8):
+        return [title for kind, pk, title in title_index.lookup(query, limit)]
+
+    def test_matches_title_and_word_prefixes(self):
+        self.lesson('Introduction to Optics')
+        self.lesson('Optics II')
+        self.lesson('الكيمياء العضوية')
+        Resource.objects.create(title='Optical illusions', type='link', author=self.teacher, is_approved=True)
+        Lesson.objects.create(title='Optics draft', content='...', author=self.teacher)
+
+        self.assertEqual(self.titles('opt'), ['Optical illusions', 'Optics II', 'Introduction to Optics'])
+        self.assertEqual(self.titles('optics '), ['Optics II', 'Introduction to Optics'])
+        self.assertEqual(self.titles('introduction to o'), ['Introduction to Optics'])
+        self.assertEqual(self.titles('العضويه'), ['الكيمياء العضوية'])
+        self.assertEqual(self.titles('opt', limit=1), ['Optical illusions'])
+        self.assertEqual(self.titles(''), [])
+
+    def test_drafts_leave_the_search_version_alone(self):
+        version = get_version(SEARCH_VERSION)
+        with self.captureOnCommitCallbacks(execute=True):
+            lesson = Lesson.objects.create(title='Draft', content='...', author=self.teacher)
+            lesson.title = 'Draft II'
+            lesson.save()
+            Test.objects.create(title='Pending test', author=self.teacher).delete()
+        self.assertEqual(get_version(SEARCH_VERSION), version)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            lesson.is_approved = True
+            lesson.save()
+        self.assertEqual(get_version(SEARCH_VERSION), version + 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            lesson.is_removed = True
+            lesson.save()
+        self.assertEqual(get_version(SEARCH_VERSION), version + 2)
+
+    def test_title_prefixes_win_over_many_later_word_matches(self):
+        Lesson.objects.bulk_create([
+            Lesson(title=f'Chapter {i} optics review', content='...', author=self.teacher, is_approved=True)
+            for i in range(100)
+        ])
+        self.lesson('Optimization')
+        titles = self.titles('opt')
+        self.assertEqual(titles[0], 'Optimization')
+        self.assertEqual(len(titles), 8)
+
+        # Also when added to a loaded index
+        self.lesson('Optical fibers')
+        self.assertEqual(self.titles('opt')[:2], ['Optical fibers', 'Optimization'])
+
+    def test_changes_are_applied_without_reloading(self):
+        lesson = self.lesson('Waves')
+        self.assertEqual(self.titles('wav'), ['Waves'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            lesson.title = 'Sound waves'
+            lesson.save()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.titles('wav'), ['Sound waves'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            lesson.is_removed = True
+            lesson.save()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.titles('wav'), [])
+
+    def test_changes_from_other_processes_reload_the_index(self):
+        self.lesson('Waves')
+        self.titles('wav')
+        Lesson.objects.create(title='Wavelets', content='...', author=self.teacher, is_approved=True)
+        bump_version(SEARCH_VERSION)
+        with self.assertNumQueries(3):
+            self.assertEqual(self.titles('wav'), ['Wavelets', 'Waves'])
+
+    def test_endpoint(self):
+        lesson = self.lesson('Genetics')
+        response = self.client.get(reverse('search_autocomplete'), {'q': 'gen'})
+        self.assertEqual(response.json()['results'], [
+            {'kind': 'lesson', 'id': lesson.pk, 'title': 'Genetics', 'url': reverse('lesson_detail', args=[lesson.pk])}
+        ])
+
+
+def pdf_file(*pages):
+    """A PDF with one line of text on each page."""
+    page_ids = [4 + 2 * i for i in range(len(pages))]
+    objects = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        b'<< /Type /Pages /Kids [%s] /Count %d >>' % (b' '.join(b'%d 0 R' % pk for pk in page_ids), len(pages)),
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>',
+    ]
+    for pk, text in zip(page_ids, pages):
+        stream = b'BT /F1 12 Tf 72 720 Td (%s) Tj ET' % text.encode()
+        objects.append(b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>' % (pk + 1))
+        objects.append(b'<< /Length %d >>\nstream\n%s\nendstream' % (len(stream), stream))
+    data = b'%PDF-1.4\n'
+    offsets = []
+    for pk, body in enumerate(objects, 1):
+        offsets.append(len(data))
+        data += b'%d 0 obj\n%s\nendobj\n' % (pk, body)
+    xref = len(data)
+    data += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+    data += b''.join(b'%010d 00000 n \n' % offset for offset in offsets)
+    data += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref)
+    return ContentFile(data, name='generated.pdf')
+
+
+class AttachmentSearchTests(ContentTestCase):
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = self.settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.teacher = create_teacher()
+        self.lesson = Lesson.objects.create(title='Optics', content='Lenses', author=self.teacher, is_approved=True)
+
+    def extract(self, text='Refraction through a prism'):
+        with mock.patch('content.jobs.extract_pdf_text', return_value=(text, 1)) as extract:
+            run_pending()
+        return extract
+
+    def test_pdf_text_is_extracted_by_a_job_and_searchable(self):
+        self.lesson.pdf_file.save('optics.pdf', ContentFile(b'%PDF-1.4 one'))
+        # Nothing is read during the upload itself
+        self.assertEqual(search('prism'), [])
+
+        self.assertEqual(self.extract().call_count, 1)
+        self.assertEqual([hit[:2] for hit in search('prism')], [('lesson', self.lesson.pk)])
+        self.assertEqual(ExtractedText.objects.get(kind='lesson', object_id=self.lesson.pk).page_count, 1)
+
+        # Edits keep the extracted text in the index; title and body still rank first
+        self.lesson.content = 'Lenses and prisms'
+        self.lesson.save()
+        other = Lesson.objects.create(title='Prisms', content='', author=self.teacher, is_approved=True)
+        self.assertEqual([hit[1] for hit in search('prism')], [other.pk, self.lesson.pk])
+
+        response = self.client.get(reverse('search'), {'q': 'refraction'})
+        self.assertEqual(response.context['lessons'][0].snippet, '<mark>Refraction</mark> through a prism')
+
+    def test_unchanged_files_are_not_extracted_again(self):
+        self.lesson.pdf_file.save('optics.pdf', ContentFile(b'%PDF-1.4 one'))
+        self.extract()
+        # The same contents uploaded again under another name
+        self.lesson.pdf_file.save('optics.pdf', ContentFile(b'%PDF-1.4 one'))
+        self.assertEqual(self.extract().call_count, 0)
+        self.assertEqual(ExtractedText.objects.get().file_name, self.lesson.pdf_file.name)
+        self.assertEqual(len(search('prism')), 1)
+
+        self.lesson.pdf_file.save('optics.pdf', ContentFile(b'%PDF-1.4 two'))
+        self.assertEqual(self.extract('Mirrors').call_count, 1)
+        self.assertEqual(search('prism'), [])
+        self.assertEqual(len(search('mirrors')), 1)
+
+    def test_removed_files_and_items_drop_their_text(self):
+        self.lesson.pdf_file.save('optics.pdf', ContentFile(b'%PDF-1.4 one'))
+        self.extract()
+        self.lesson.pdf_file = None
+        self.lesson.save()
+        # Text of a file the item no longer has is never indexed
+        self.assertEqual(search('prism'), [])
+        run_pending()
+        self.assertFalse(ExtractedText.objects.exists())
+
+        resource = Resource.objects.create(title='Slides', type='pdf', author=self.teacher, file=ContentFile(b'%PDF', name='slides.pdf'))
+        self.extract()
+        resource.delete()
+        self.assertFalse(ExtractedText.objects.exists())
+
+    def test_missing_pypdf_is_logged(self):
+        self.lesson.pdf_file.save('optics.pdf', ContentFile(b'%PDF-1.4 one'))
+        with mock.patch('content.jobs.extract_pdf_text', side_effect=ImportError), \
+                self.assertLogs('content.jobs', 'WARNING') as logs:
+            run_pending()
+        self.assertIn('pypdf is not installed', logs.output[0])
+        self.assertFalse(ExtractedText.objects.exists())
+
+    def test_backfill_command(self):
+        # Uploaded before extraction existed: no job was queued
+        name = self.lesson.pdf_file.storage.save('lessons/pdfs/old.pdf', ContentFile(b'%PDF-1.4 old'))
+        Lesson.objects.filter(pk=self.lesson.pk).update(pdf_file=name)
+        out = StringIO()
+        with mock.patch('content.jobs.extract_pdf_text', return_value=('Refraction', 1)):
+            call_command('extract_pdf_text', stdout=out)
+            call_command('extract_pdf_text', stdout=out)
+        self.assertIn('Extracted 1 files, 0 unchanged, 0 skipped', out.getvalue())
+        self.assertIn('Extracted 0 files, 1 unchanged, 0 skipped', out.getvalue())
+        self.assertEqual(len(search('refraction')), 1)
+
+
+    @skipUnless(pypdf, 'pypdf is not installed')
+    def test_pdf_text_is_read_page_by_page_within_limits(self):
+        file = pdf_file('Refraction of light', 'Total internal reflection', 'Dispersion')
+        text, page_count = extract_pdf_text(file)
+        self.assertEqual(page_count, 3)
+        self.assertEqual(text.split('\n'), ['Refraction of light', 'Total internal reflection', 'Dispersion'])
+
+        with self.settings(SEARCH_PDF_MAX_PAGES=1):
+            self.assertEqual(extract_pdf_text(file), ('Refraction of light', 1))
+        with self.settings(SEARCH_PDF_MAX_CHARS=25):
+            self.assertEqual(extract_pdf_text(file), ('Refraction of light\nTotal ', 2))
+
+    @skipUnless(pypdf, 'pypdf is not installed')
+    def test_malformed_pdfs_give_no_text(self):
+        for data in (b'%PDF-1.4 garbage', pdf_file('Optics').read()[:-40], b''):
+            with self.assertLogs('content.extraction', 'WARNING'):
+                self.assertEqual(extract_pdf_text(ContentFile(data, name='broken.pdf')), ('', 0))
+
+    @skipUnless(pypdf, 'pypdf is not installed')
+    def test_uploaded_pdfs_are_indexed_by_the_job(self):
+        self.lesson.pdf_file.save('optics.pdf', pdf_file('Snell law of refraction'))
+        run_pending()
+        self.assertEqual([hit[:2] for hit in search('snell')], [('lesson', self.lesson.pk)])
+
+class SearchCacheTests(ContentTestCase):
+    def setUp(self):
+        super().setUp()
+        self.teacher = create_teacher()
+        self.lesson = Lesson.objects.create(title='Optics', content='Lenses and mirrors', author=self.teacher, is_approved=True)
+
+    def test_normalized_queries_share_cached_results(self):
+        hits = cached_search('Lenses mirrors')
+        self.assertEqual([hit[:2] for hit in hits], [('lesson', self.lesson.pk)])
+        with self.assertNumQueries(0):
+            self.assertEqual(cached_search('MIRRORS  lenses'), hits)
+            self.assertEqual(cached_search('?!'), [])
+        self.assertEqual(search_cache_stats(), {'hits': 1, 'misses': 1})
+
+    def test_changes_to_the_index_invalidate_results(self):
+        self.assertEqual(len(cached_search('optics')), 1)
+        other = Lesson.objects.create(title='Optics II', content='Prisms', author=self.teacher)
+        with self.captureOnCommitCallbacks(execute=True):
+            other.is_approved = True
+            other.save()
+        self.assertEqual(len(cached_search('optics')), 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.lesson.title = 'Acoustics'
+            self.lesson.save()
+        self.assertEqual([hit[1] for hit in cached_search('optics')], [other.pk])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            other.is_removed = True
+            other.save()
+        self.assertEqual(cached_search('optics'), [])
+        self.assertEqual(search_cache_stats(), {'hits': 0, 'misses': 4})
+
+    def test_dashboard_shows_the_hit_rate_to_staff(self):
+        cached_search('optics')
+        cached_search('optics')
+        cached_search('lenses')
+        admin = CustomUser.objects.create_superuser(username='admin', password='password')
+        self.client.force_login(admin)
+        self.assertEqual(self.client.get(reverse('dashboard:home')).context['search_cache'], {'hits': 1, 'misses': 2, 'hit_rate': 33})
+        self.client.force_login(self.teacher)
+        self.assertNotIn('search_cache', self.client.get(reverse('dashboard:home')).context)
+
+
+class TestGradingTests(ContentTestCase):
+    def setUp(self):
+        super().setUp()
+        self.teacher = create_teacher()
+        self.student = create_student()
+        self.client.force_login(self.student)
+        self.test = Test.objects.create(title='Exam', author=self.teacher, is_approved=True)
+
+    def add_questions(self, count):
+        return Question.objects.bulk_create([
+            Question(test=self.test, text=f'Q{i}', option_a='a', option_b='b', option_c='c', option_d='d', correct_option='ABCD'[i % 4])
+            for i in range(count)
+        ])
+
+    def submit(self, questions, options):
+        data = {f'question_{question.id}': option for question, option in zip(questions, options)}
+        return self.client.post(reverse('take_test', args=[self.test.pk]), data)
+
+    def test_submission_is_graded_and_stored_in_one_pass(self):
+        questions = self.add_questions(40)
+        Question.objects.filter(pk=questions[-1].pk).update(is_removed=True)
+        questions = questions[:-1]
+        options = [question.correct_option if i % 3 else 'A' for i, question in enumerate(questions)]
+        with self.assertNumQueries(8):
+            # Session, user, test, questions, then the result and every answer
+            # inserted in a savepoint, and the saved session
+            response = self.submit(questions, options)
+
+        result = Result.objects.get()
+        self.assertRedirects(response, reverse('result_detail', args=[result.pk]))
+        expected = [option == question.correct_option for question, option in zip(questions, options)]
+        self.assertEqual((result.score, result.total_questions), (sum(expected), 39))
+        self.assertEqual(
+            list(result.answers.order_by('question_id').values_list('selected_option', 'is_correct')),
+            list(zip(options, expected))
+        )
+
+    def test_incomplete_or_invalid_submissions_are_not_saved(self):
+        questions = self.add_questions(3)
+        response = self.submit(questions, ['A', 'B'])
+        self.assertEqual(response.status_code, 200)
+        response = self.submit(questions, ['A', 'B', 'E'])
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '3 Questions')
+        self.assertFalse(Result.objects.exists())
+        self.assertFalse(StudentAnswer.objects.exists())
+
+    def test_questions_are_cached_until_they_change(self):
+        questions = self.add_questions(3)
+        url = reverse('take_test', args=[self.test.pk])
+        self.client.get(url)
+        with self.assertNumQueries(3):
+            # Session, user and test; no question is read
+            self.assertContains(self.client.get(url), '3 Questions')
+        with self.assertNumQueries(7):
+            self.submit(questions, 'ABC')
+
+        teacher = Client()
+        teacher.force_login(self.teacher)
+        with self.captureOnCommitCallbacks(execute=True):
+            teacher.post(reverse('question_add', args=[self.test.pk]), {
+                'text': 'Q3', 'option_a': 'a', 'option_b': 'b', 'option_c': 'c', 'option_d': 'd', 'correct_option': 'D'
+            })
+        self.assertContains(self.client.get(url), '4 Questions')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            questions[0].is_removed = True
+            questions[0].save()
+        response = self.client.get(url)
+        self.assertContains(response, '3 Questions')
+        self.assertNotContains(response, 'question_%d"' % questions[0].pk)
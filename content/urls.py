@@ -3,6 +3,7 @@ from . import views
 
 urlpatterns = [
     path('search/', views.search_view, name='search'),
+    path('search/autocomplete/', views.search_autocomplete, name='search_autocomplete'),
     path('lessons/', views.LessonListView.as_view(), name='lesson_list'),
     path('lessons/create/', views.LessonCreateView.as_view(), name='lesson_create'),
     path('lessons/<int:pk>/', views.LessonDetailView.as_view(), name='lesson_detail'),
@@ -24,6 +25,9 @@ urlpatterns = [
     path('chat/<int:year>/<str:stream>/send/', views.send_message, name='send_message'),
     path('chat/clear/', views.clear_chat_history, name='clear_chat_history'),
     path('chat/<int:year>/<str:stream>/messages/', views.get_messages, name='get_messages'),
+    path('chat/<int:year>/<str:stream>/history/', views.chat_history, name='chat_history'),
+    path('chat/<int:year>/<str:stream>/poll/', views.poll_messages, name='poll_messages'),
+    path('chat/<int:year>/<str:stream>/events/', views.chat_events, name='chat_events'),
     path('chat/message/edit/<int:pk>/', views.edit_chat_message, name='edit_chat_message'),
     path('chat/message/delete/<int:pk>/', views.delete_chat_message, name='delete_chat_message'),
     
@@ -44,7 +48,10 @@ urlpatterns = [
     
     # Notifications
     path('notifications/', views.notification_list, name='notification_list'),
+    path('notifications/count/', views.notification_count, name='notification_count'),
+    path('notifications/read/', views.mark_notifications_read, name='mark_notifications_read'),
     path('notifications/read/<int:pk>/', views.mark_notification_read, name='mark_notification_read'),
+    path('notifications/announcements/read/<int:pk>/', views.mark_announcement_read, name='mark_announcement_read'),
     
     # Deletion
     path('lessons/delete/<int:pk>/', views.delete_lesson, name='lesson_delete'),
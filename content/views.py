@@ -1,26 +1,70 @@
+import asyncio
+import json
+import math
+
 from django.shortcuts import render, redirect, get_object_or_404
 from django.utils.translation import gettext as _
 
-from django.db.models import Q
 from django.urls import reverse_lazy
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.views.generic import ListView, DetailView, CreateView, UpdateView, DeleteView
 from django.contrib import messages
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
 from django.utils import timezone
+from django.utils.decorators import method_decorator
+from django.utils.translation import get_language
+from django.views.decorators.http import condition
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from asgiref.sync import sync_to_async
 from .models import Lesson, Test, Question, Result, Announcement, ChatMessage, Resource, ForumThread, ForumPost, LessonComment, StudentAnswer, Notification
 from .forms import LessonForm, TestForm, QuestionForm, AnnouncementForm, ResourceForm, ForumThreadForm, ForumPostForm, LessonCommentForm
 from django.contrib.contenttypes.models import ContentType
 from users.models import YEAR_CHOICES, STREAM_CHOICES, SUBJECT_CHOICES
+from .notifications import cached_unread_notification_count, mark_all_read, mark_announcements_seen, mark_read, notification_page
+from .autocomplete import item_url, title_index
+from .search import search_results
+from .grading import question_set, record_result, submitted_answers
+from .chat import chat_broker, can_access_room, encode_cursor, fetch_changes, fetch_entries, fetch_history, present_entry, room_version_name, serialize_message
+from core.ratelimit import take_token
+from core.versions import get_version, make_etag
 
 def is_teacher(user):
     return user.is_authenticated and user.is_active and (user.is_teacher or user.is_staff)
 
-from django.db.models import Q, Count
+def page_etag(request, *version_names):
+    """
+    ETag for a page built from the given model version counters plus
+    everything the navbar shows for the current user.
+    """
+    csrf_cookie = request.META.get('CSRF_COOKIE')
+    if not csrf_cookie or len(messages.get_messages(request)):
+        # The page would carry a new CSRF token or flash messages
+        return None
+    user = request.user
+    parts = [get_version(name) for name in version_names + ('announcement', 'users')]
+    parts += [request.get_full_path(), get_language(), csrf_cookie, user.pk]
+    if user.is_authenticated:
+        parts.append(get_version(f'notifications:{user.pk}'))
+    return make_etag(*parts)
+
+def chat_etag(request, year, stream):
+    if not can_access_room(request.user, year, stream):
+        return None
+    return make_etag(
+        get_version(room_version_name(year, stream)),
+        request.user.pk,
+        request.user.last_chat_clear_time,
+        request.GET.urlencode()
+    )
+
+from django.db.models import Count
 
 # ... (imports)
 
+@method_decorator(condition(etag_func=lambda request: page_etag(request, 'lesson')), name='get')
 class LessonListView(ListView):
     model = Lesson
     template_name = 'content/lesson_list.html'
@@ -173,28 +217,18 @@ def question_add(request, test_pk):
 @login_required
 def take_test(request, pk):
     test = get_object_or_404(Test, pk=pk, is_removed=False)
-    questions = test.questions.filter(is_removed=False)
+    # The questions and their answer key, read once for rendering and grading
+    questions = question_set(test)
     
-    if not questions.exists():
+    if not questions:
         messages.warning(request, _("This test does not have any questions yet."))
 
         return redirect('test_detail', pk=test.pk)
     
     if request.method == 'POST':
-        score = 0
-        all_answered = True
-        answers = {}
-        
-        for question in questions:
-            selected_option = request.POST.get(f'question_{question.id}')
-            if not selected_option:
-                all_answered = False
-            answers[question.id] = selected_option
-            
-            if selected_option == question.correct_option:
-                score += 1
+        answers = submitted_answers(questions, request.POST)
         
-        if not all_answered:
+        if None in answers.values():
             messages.error(request, _('Please answer all questions before submitting.'))
 
             return render(request, 'content/take_test.html', {
@@ -203,24 +237,9 @@ def take_test(request, pk):
                 'previous_answers': answers
             })
 
-        result = Result.objects.create(
-            student=request.user,
-            test=test,
-            score=score,
-            total_questions=questions.count()
-        )
-
-        # Save individual answers
-        for q_id, selected_opt in answers.items():
-            question = questions.get(id=q_id)
-            StudentAnswer.objects.create(
-                result=result,
-                question=question,
-                selected_option=selected_opt,
-                is_correct=(selected_opt == question.correct_option)
-            )
+        result = record_result(request.user, test, questions, answers)
 
-        messages.success(request, _('Test completed! Your score: {score}/{total}').format(score=score, total=questions.count()))
+        messages.success(request, _('Test completed! Your score: {score}/{total}').format(score=result.score, total=result.total_questions))
 
         return redirect('result_detail', pk=result.pk)
     
@@ -236,6 +255,7 @@ def result_detail(request, pk):
         return redirect('lesson_list')
     return render(request, 'content/result_detail.html', {'result': result})
 
+@condition(etag_func=lambda request: page_etag(request, 'test'))
 def test_list(request):
     tests = Test.objects.select_related('author').filter(is_approved=True, is_removed=False).order_by('-created_at')
     
@@ -344,17 +364,9 @@ def clear_chat_history(request):
 
 @login_required
 def chat_room(request, year, stream):
-    if not (request.user.is_teacher or request.user.is_staff or 
-            (request.user.year == year and request.user.stream == stream)):
+    if not can_access_room(request.user, year, stream):
         return redirect('home')
     
-    chat_messages = ChatMessage.objects.filter(year=year, stream=stream, is_removed=False)
-    if request.user.last_chat_clear_time:
-        chat_messages = chat_messages.filter(created_at__gt=request.user.last_chat_clear_time)
-        
-    chat_messages = chat_messages.order_by('-created_at')[:50]
-    chat_messages = reversed(chat_messages)
-    
     stream_display = dict(STREAM_CHOICES).get(stream, stream)
     
     return render(request, 'content/chat.html', {
@@ -368,12 +380,26 @@ def chat_room(request, year, stream):
 @login_required
 def send_message(request, year, stream):
     if request.method == 'POST' and request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-        if not (request.user.is_teacher or request.user.is_staff or 
-                (request.user.year == year and request.user.stream == stream)):
+        if not can_access_room(request.user, year, stream):
             return JsonResponse({'success': False, 'error': 'Not authorized'}, status=403)
         
         message_text = request.POST.get('message', '').strip()
         if message_text:
+            allowed, retry_after = take_token(
+                f'chat:{request.user.pk}:{year}:{stream}',
+                settings.CHAT_SEND_BURST, settings.CHAT_SEND_PER_MINUTE / 60
+            )
+            if not allowed:
+                retry_after = math.ceil(retry_after)
+                response = JsonResponse({
+                    'success': False,
+                    'error': 'Too many messages',
+                    'code': 'rate_limited',
+                    'retry_after': retry_after
+                }, status=429)
+                response['Retry-After'] = retry_after
+                return response
+
             msg = ChatMessage.objects.create(
                 author=request.user,
                 year=year,
@@ -382,54 +408,129 @@ def send_message(request, year, stream):
             )
             return JsonResponse({
                 'success': True,
-                'message': {
-                    'id': msg.id,
-                    'author': msg.author.nickname or msg.author.real_name or msg.author.username,
-                    'is_mine': True,
-                    'text': msg.message,
-                    'time': msg.created_at.strftime('%b %d, %H:%M')
-                }
+                'message': serialize_message(msg, request.user)
             })
     
     return JsonResponse({'success': False}, status=400)
 
 @login_required
+@condition(etag_func=chat_etag)
 def get_messages(request, year, stream):
-    if not (request.user.is_teacher or request.user.is_staff or 
-            (request.user.year == year and request.user.stream == stream)):
+    if not can_access_room(request.user, year, stream):
         return JsonResponse({'success': False, 'error': 'Not authorized'}, status=403)
     
+    since = request.GET.get('since', '')
+    if since.isdigit():
+        return JsonResponse({'success': True, **fetch_changes(request.user, year, stream, int(since))})
+
     last_id = request.GET.get('last_id')
-    messages_query = ChatMessage.objects.filter(year=year, stream=stream, is_removed=False)
-    
-    if request.user.last_chat_clear_time:
-        messages_query = messages_query.filter(created_at__gt=request.user.last_chat_clear_time)
-    
-    if last_id and last_id.isdigit():
-        messages_query = messages_query.filter(id__gt=int(last_id))
-    else:
-        # Load only the last 50 messages locally to prevent huge payload
-        messages_query = messages_query.order_by('-created_at')[:50]
-        # Reverse back to chronological order for display
-        messages_query = sorted(messages_query, key=lambda x: x.created_at)
-
-    message_list = []
-    for msg in messages_query:
-        message_list.append({
-            'id': msg.id,
-            'author': msg.author.nickname or msg.author.real_name or msg.author.username,
-            'is_mine': msg.author == request.user,
-            'text': msg.message,
-            'time': msg.created_at.strftime('%b %d, %H:%M')
-        })
-    
-    return JsonResponse({'success': True, 'messages': message_list})
+    entries, version = fetch_entries(request.user, year, stream, last_id)
+    response = {
+        'success': True,
+        'messages': [present_entry(entry, request.user) for entry in entries],
+        # Change version to sync edits and removals from
+        'version': version
+    }
+    if entries and not last_id:
+        # Cursor for loading older messages through chat_history
+        response['before'] = encode_cursor(entries[0])
+    return JsonResponse(response)
+
+@login_required
+def chat_history(request, year, stream):
+    if not can_access_room(request.user, year, stream):
+        return JsonResponse({'success': False, 'error': 'Not authorized'}, status=403)
+
+    limit = request.GET.get('limit', '')
+    try:
+        entries, before, after = fetch_history(
+            request.user, year, stream,
+            before=request.GET.get('before'),
+            after=request.GET.get('after'),
+            limit=int(limit) if limit.isdigit() else None
+        )
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'Invalid cursor'}, status=400)
+
+    return JsonResponse({
+        'success': True,
+        'messages': [present_entry(entry, request.user) for entry in entries],
+        'before': before,
+        'after': after
+    })
+
+@login_required
+async def poll_messages(request, year, stream):
+    """
+    Long-poll fallback for clients without Server-Sent Events: holds the request
+    open until the room changes after version ``since`` or CHAT_LONG_POLL_TIMEOUT
+    expires, then returns the delta.
+    """
+    user = await request.auser()
+    if not can_access_room(user, year, stream):
+        return JsonResponse({'success': False, 'error': 'Not authorized'}, status=403)
+
+    since = request.GET.get('since', '')
+    if not since.isdigit():
+        return JsonResponse({'success': False, 'error': 'Missing change version'}, status=400)
+
+    room = (year, stream)
+    since = int(since)
+    version = chat_broker.version(room)
+    delta = await sync_to_async(fetch_changes)(user, year, stream, since)
+    if delta['version'] == since and await chat_broker.wait(room, version, settings.CHAT_LONG_POLL_TIMEOUT):
+        delta = await sync_to_async(fetch_changes)(user, year, stream, since)
+    return JsonResponse({'success': True, **delta})
+
+@login_required
+async def chat_events(request, year, stream):
+    """
+    Server-Sent Events stream of room deltas since change version ``since``.
+    Only served under ASGI; WSGI workers would buffer the whole stream.
+    """
+    user = await request.auser()
+    if not can_access_room(user, year, stream):
+        return JsonResponse({'success': False, 'error': 'Not authorized'}, status=403)
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({'success': False, 'error': 'Streaming requires an ASGI server'}, status=501)
+
+    # EventSource sends Last-Event-ID on reconnect, which is fresher than the query string
+    since = request.headers.get('Last-Event-ID') or request.GET.get('since', '')
+    if not since.isdigit():
+        return JsonResponse({'success': False, 'error': 'Missing change version'}, status=400)
+
+    response = StreamingHttpResponse(
+        _chat_event_stream(user, year, stream, int(since)),
+        content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+async def _chat_event_stream(user, year, stream, since):
+    room = (year, stream)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + settings.CHAT_STREAM_LIFETIME
+    yield 'retry: 3000\nevent: ready\ndata: {}\n\n'
+
+    while loop.time() < deadline:
+        version = chat_broker.version(room)
+        delta = await sync_to_async(fetch_changes)(user, year, stream, since)
+        if delta['version'] != since:
+            since = delta['version']
+            data = json.dumps(delta, cls=DjangoJSONEncoder)
+            yield f'id: {since}\nevent: delta\ndata: {data}\n\n'
+            if delta['has_more']:
+                # Catching up from an old version; send the next delta straight away
+                continue
+        if not await chat_broker.wait(room, version, settings.CHAT_STREAM_KEEPALIVE):
+            yield ': keepalive\n\n'
 
 @login_required
 def edit_chat_message(request, pk):
     if request.method == 'POST':
         message = get_object_or_404(ChatMessage, pk=pk)
-        if message.author != request.user:
+        if message.author_id != request.user.pk:
             return JsonResponse({'success': False, 'error': 'Not authorized'}, status=403)
         
         new_text = request.POST.get('message', '').strip()
@@ -445,7 +546,7 @@ def edit_chat_message(request, pk):
 def delete_chat_message(request, pk):
     if request.method == 'POST':
         message = get_object_or_404(ChatMessage, pk=pk)
-        if message.author == request.user or request.user.is_staff or request.user.is_teacher:
+        if message.author_id == request.user.pk or request.user.is_staff or request.user.is_teacher:
             message.is_removed = True
             message.save()
             return JsonResponse({'success': True})
@@ -453,6 +554,7 @@ def delete_chat_message(request, pk):
     return JsonResponse({'success': False}, status=400)
 
 # Library Views
+@condition(etag_func=lambda request: page_etag(request, 'resource'))
 def resource_list(request):
     resources = Resource.objects.select_related('author').filter(is_approved=True, is_removed=False).order_by('-created_at')
     
@@ -662,20 +764,17 @@ def search_view(request):
     resources = []
     
     if query:
-        lessons = Lesson.objects.filter(
-            Q(title__icontains=query) | Q(content__icontains=query),
-            is_approved=True, is_removed=False
-        ).distinct()
-        
-        tests = Test.objects.filter(
-            Q(title__icontains=query) | Q(description__icontains=query),
-            is_approved=True, is_removed=False
-        ).distinct()
-        
-        resources = Resource.objects.filter(
-            Q(title__icontains=query),
-            is_approved=True, is_removed=False
-        ).distinct()
+        pages = search_results(query, {kind: request.GET.get(f'{kind}_page') for kind in ('lesson', 'test', 'resource')})
+        for kind, page in pages.items():
+            # Paging through one kind keeps the pages shown of the others
+            params = request.GET.copy()
+            if page.has_previous():
+                params[f'{kind}_page'] = page.previous_page_number()
+                page.previous_url = '?' + params.urlencode()
+            if page.has_next():
+                params[f'{kind}_page'] = page.next_page_number()
+                page.next_url = '?' + params.urlencode()
+        lessons, tests, resources = pages['lesson'], pages['test'], pages['resource']
         
     return render(request, 'content/search_results.html', {
         'query': query,
@@ -684,6 +783,14 @@ def search_view(request):
         'resources': resources
     })
 
+def search_autocomplete(request):
+    query = request.GET.get('q', '')[:100]
+    results = [
+        {'kind': kind, 'id': pk, 'title': title, 'url': item_url(kind, pk)}
+        for kind, pk, title in title_index.lookup(query, settings.SEARCH_AUTOCOMPLETE_LIMIT)
+    ]
+    return JsonResponse({'success': True, 'results': results})
+
 @login_required
 @user_passes_test(is_teacher)
 def test_analytics(request, pk):
@@ -736,13 +843,40 @@ def test_analytics(request, pk):
 
 @login_required
 def notification_list(request):
-    notifications = Notification.objects.filter(recipient=request.user, is_removed=False)
-    unread_count = notifications.filter(is_read=False).count()
+    before = request.GET.get('before') or None
+    try:
+        notifications, next_cursor = notification_page(request.user, before)
+    except ValueError:
+        return redirect('notification_list')
     return render(request, 'content/notifications.html', {
         'notifications': notifications,
-        'unread_count': unread_count
+        'next_cursor': next_cursor,
+        'is_first_page': before is None,
+        'unread_count': cached_unread_notification_count(request.user)
     })
 
+@login_required
+def notification_count(request):
+    return JsonResponse({'success': True, 'unread': cached_unread_notification_count(request.user)})
+
+@login_required
+def mark_notifications_read(request):
+    if request.method != 'POST':
+        return redirect('notification_list')
+
+    if request.POST.get('all'):
+        mark_all_read(request.user)
+    else:
+        mark_read(
+            request.user,
+            [int(pk) for pk in request.POST.getlist('notification') if pk.isdigit()],
+            [int(pk) for pk in request.POST.getlist('announcement') if pk.isdigit()]
+        )
+
+    if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+        return JsonResponse({'success': True, 'unread': cached_unread_notification_count(request.user)})
+    return redirect('notification_list')
+
 @login_required
 def mark_notification_read(request, pk):
     notification = get_object_or_404(Notification, pk=pk, recipient=request.user, is_removed=False)
@@ -752,3 +886,10 @@ def mark_notification_read(request, pk):
     if notification.link:
         return redirect(notification.link)
     return redirect('notification_list')
+
+@login_required
+def mark_announcement_read(request, pk):
+    announcement = get_object_or_404(Announcement, pk=pk, is_removed=False)
+    # Read state is a watermark, so this also marks older announcements read
+    mark_announcements_seen(request.user, announcement.created_at)
+    return redirect('/')
@@ -0,0 +1,27 @@
+import math
+import time
+
+from django.core.cache import cache
+
+# Token buckets kept in the cache, so every worker sharing the cache enforces
+# the same limit without touching the database. Reads and writes are not
+# atomic; concurrent requests of one client may occasionally both get the
+# last token, which is fine for a spam guard.
+
+
+def take_token(name, capacity, per_second):
+    """
+    Take a token from bucket ``name``, which holds up to ``capacity`` tokens
+    and refills at ``per_second`` tokens per second. Returns ``(allowed,
+    retry_after)``, where ``retry_after`` is the number of seconds until the
+    next token is available when the request is refused.
+    """
+    key = f'ratelimit:{name}'
+    now = time.time()
+    tokens, updated = cache.get(key, (capacity, now))
+    tokens = min(capacity, tokens + (now - updated) * per_second)
+    if tokens < 1:
+        return False, (1 - tokens) / per_second
+    # An untouched bucket is full again after capacity / per_second seconds
+    cache.set(key, (tokens - 1, now), math.ceil(capacity / per_second))
+    return True, 0
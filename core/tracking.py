@@ -0,0 +1,51 @@
+from django.db.models.fields.files import FieldFile
+
+# Models list the fields signal handlers care about in ``tracked_fields``;
+# their values are remembered when a row is loaded and after every save, so a
+# handler can tell a real change from a plain re-save without reading the row
+# again. Instances that were never loaded or saved have nothing to compare
+# with and report no changes.
+
+
+class TrackedFieldsMixin:
+    """Remembers the loaded values of ``tracked_fields``. Put it before ``models.Model``."""
+    tracked_fields = ()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._remember_tracked_fields()
+        return instance
+
+    def save(self, *args, **kwargs):
+        # post_save handlers run inside this call and still see the old values
+        super().save(*args, **kwargs)
+        self._remember_tracked_fields(kwargs.get('update_fields'))
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        super().refresh_from_db(using, fields, **kwargs)
+        self._remember_tracked_fields(fields)
+
+    def _tracked_value(self, name):
+        value = getattr(self, self._meta.get_field(name).attname)
+        # Files are compared by the name stored in the column
+        return value.name if isinstance(value, FieldFile) else value
+
+    def _remember_tracked_fields(self, fields=None):
+        if not hasattr(self, '_tracked_values'):
+            self._tracked_values = {}
+        for name in self.tracked_fields:
+            if fields is not None and name not in fields:
+                continue
+            # Deferred fields are skipped rather than loaded with a query
+            if self._meta.get_field(name).attname in self.__dict__:
+                self._tracked_values[name] = self._tracked_value(name)
+
+    def previous_value(self, name):
+        """Value of a tracked field when the instance was loaded or last saved, or None if unknown."""
+        return getattr(self, '_tracked_values', {}).get(name)
+
+    def has_changed(self, name):
+        """Whether a tracked field differs from its remembered value."""
+        tracked = getattr(self, '_tracked_values', {})
+        return name in tracked and tracked[name] != self._tracked_value(name)
@@ -0,0 +1,40 @@
+import hashlib
+import time
+
+from django.core.cache import cache
+
+# Version counters kept in the cache. They are bumped after a write commits
+# and used to build ETags and to spot stale in-memory data. A missing counter
+# is seeded from the clock, so an evicted counter never goes back to a value
+# a client may still hold.
+
+
+def _key(name):
+    return f'version:{name}'
+
+
+def _seed():
+    return int(time.time() * 1000)
+
+
+def get_version(name):
+    key = _key(name)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _seed(), None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(name):
+    key = _key(name)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        version = _seed()
+        cache.set(key, version, None)
+        return version
+
+
+def make_etag(*parts):
+    return hashlib.md5(':'.join(str(part) for part in parts).encode()).hexdigest()
@@ -46,6 +46,7 @@ INSTALLED_APPS = [
     'main',
     'dashboard',
     'moderation',
+    'jobs',
 ]
 
 MIDDLEWARE = [
@@ -71,6 +72,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'content.context_processors.notifications',
             ],
         },
     },
@@ -89,6 +91,28 @@ DATABASES = {
     }
 }
 
+# Chat can be moved to its own SQLite file so busy rooms don't hold the main
+# database's write lock. Create its tables with `migrate --database=chat`.
+if os.getenv('SEPARATE_CHAT_DB') == 'True':
+    DATABASES['chat'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'chat.sqlite3',
+    }
+
+DATABASE_ROUTERS = ['content.routers.ChatRouter']
+
+
+# Cache
+# Chat room buffers and page ETags rely on version counters kept here, so
+# deployments running more than one worker process need a shared backend.
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    }
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
@@ -147,6 +171,42 @@ AUTH_USER_MODEL = 'users.CustomUser'
 # Login URL
 LOGIN_URL = '/users/login/'
 
+# Chat
+CHAT_PAGE_SIZE = 50  # Messages returned on first load
+CHAT_BUFFER_SIZE = 200  # Recent messages kept in memory per room
+CHAT_HISTORY_MAX_PAGE = 100  # Hard cap on messages returned by one history or catch-up request
+CHAT_CHANGES_MAX = 500  # Changes folded into one sync delta
+CHAT_LONG_POLL_TIMEOUT = 25  # Seconds a long-poll request is held open
+CHAT_STREAM_KEEPALIVE = 20  # Seconds between SSE keepalives (and database re-checks)
+CHAT_STREAM_LIFETIME = 300  # Seconds before an SSE stream closes and the browser reconnects
+CHAT_SEND_BURST = 5  # Messages a user can send to a room in a quick burst
+CHAT_SEND_PER_MINUTE = 20  # Sustained messages per minute per user and room
+CHAT_RETENTION_DAYS = 180  # Older messages are moved to the archive by `archive_chat`
+CHAT_ARCHIVE_BATCH_SIZE = 500  # Messages moved per archive_chat transaction
+
+# Notifications
+NOTIFICATIONS_PAGE_SIZE = 20  # Notifications per inbox page
+NOTIFICATION_RETENTION_DAYS = 180  # Read or removed notifications older than this are deleted by `purge_notifications`
+NOTIFICATION_PURGE_BATCH_SIZE = 500  # Notifications deleted per purge_notifications transaction
+
+# Search
+SEARCH_INDEX_BATCH_SIZE = 500  # Items written per insert by rebuild_search_index
+SEARCH_RESULTS_PER_PAGE = 10  # Results of each kind per search page
+SEARCH_SNIPPET_WORDS = 30  # Words of text shown around the first match
+SEARCH_CACHE_TIMEOUT = 600  # Seconds a query's results stay cached; any change to the index invalidates them sooner
+SEARCH_AUTOCOMPLETE_LIMIT = 8  # Title suggestions returned per keystroke
+SEARCH_ARABIC_STEMMING = True  # Strip common Arabic prefixes and suffixes; run rebuild_search_index after changing
+SEARCH_PDF_MAX_PAGES = 200  # Pages of an uploaded PDF whose text is indexed (needs pypdf)
+SEARCH_PDF_MAX_CHARS = 500000  # Characters of an uploaded PDF's text that are indexed
+
+# Background jobs, run by `manage.py run_jobs`
+JOBS_RUN_EAGERLY = os.getenv('JOBS_RUN_EAGERLY') == 'True'  # Run jobs in-process after commit, without a worker
+JOBS_BATCH_SIZE = 100  # Jobs a worker claims per round
+JOBS_MAX_ATTEMPTS = 5
+JOBS_RETRY_DELAY = 30  # Seconds before the first retry; doubled for each further attempt
+JOBS_LEASE = 300  # Seconds before a job claimed by a dead worker is picked up again
+JOBS_POLL_INTERVAL = 1  # Seconds a worker waits when no job is due
+
 # CSRF Settings
 CSRF_COOKIE_HTTPONLY = False  # Allow JavaScript to read CSRF cookie
 LOGGING = {
@@ -0,0 +1,10 @@
+from django.core.files.storage import default_storage
+
+from .queue import job
+
+
+@job(batched=True)
+def delete_files(payloads):
+    """Delete files left behind by deleted or replaced uploads."""
+    for name in {payload['name'] for payload in payloads}:
+        default_storage.delete(name)
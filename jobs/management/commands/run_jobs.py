@@ -0,0 +1,41 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from jobs.queue import run_pending
+
+
+class Command(BaseCommand):
+    help = 'Runs queued background jobs, polling for new ones until stopped.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Exit once no job is due')
+        parser.add_argument(
+            '--batch-size', type=int, default=settings.JOBS_BATCH_SIZE,
+            help='Jobs claimed per round'
+        )
+        parser.add_argument(
+            '--sleep', type=float, default=settings.JOBS_POLL_INTERVAL,
+            help='Seconds to wait when no job is due'
+        )
+
+    def handle(self, *args, **options):
+        total_done = total_failed = 0
+        try:
+            while True:
+                close_old_connections()
+                done, failed = run_pending(options['batch_size'])
+                total_done += done
+                total_failed += failed
+                if done or failed:
+                    if options['verbosity'] > 1:
+                        self.stdout.write(f'Ran {done} jobs, {failed} failed.')
+                    continue
+                if options['once']:
+                    break
+                time.sleep(options['sleep'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(f'{total_done} jobs done, {total_failed} failed.')
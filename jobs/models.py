@@ -0,0 +1,38 @@
+from django.db import models
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+
+
+class Job(models.Model):
+    """
+    A queued background job: the name of a registered handler and its JSON
+    payload. Workers (`manage.py run_jobs`) claim due jobs, delete them once
+    they succeed and retry them with a growing delay when they fail.
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, _('Pending')),
+        (RUNNING, _('Running')),
+        (FAILED, _('Failed')),
+    ]
+    name = models.CharField(_('Name'), max_length=200)
+    payload = models.JSONField(_('Payload'), default=dict)
+    status = models.CharField(_('Status'), max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(_('Attempts'), default=0)
+    max_attempts = models.PositiveSmallIntegerField(_('Max Attempts'), default=5)
+    run_after = models.DateTimeField(_('Run After'), default=timezone.now)
+    claimed_by = models.CharField(_('Claimed By'), max_length=32, blank=True)
+    locked_until = models.DateTimeField(_('Locked Until'), null=True, blank=True)
+    last_error = models.TextField(_('Last Error'), blank=True)
+    created_at = models.DateTimeField(_('Created At'), auto_now_add=True)
+
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after']),
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.status}, attempt {self.attempts})"
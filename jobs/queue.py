@@ -0,0 +1,128 @@
+import logging
+import uuid
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+_handlers = {}
+
+
+def job(name=None, batched=False, max_attempts=None):
+    """
+    Register a function as a background job, by default under its dotted path.
+
+    A batched job is called once with the list of payloads of all its claimed
+    jobs, so it can do their work in bulk; any other job is called with its
+    payload as keyword arguments. When a batch fails, its payloads are run
+    again one at a time, so only the jobs that fail on their own are retried.
+    A job may run more than once, so handlers must be idempotent.
+    """
+    def decorator(func):
+        func.job_name = name or f'{func.__module__}.{func.__name__}'
+        _handlers[func.job_name] = (func, batched, max_attempts or settings.JOBS_MAX_ATTEMPTS)
+        return func
+    return decorator
+
+
+def enqueue(handler, **payload):
+    """
+    Queue ``handler`` (a registered function or its name) with a JSON payload.
+    The job is written in the current transaction, so workers only see it if
+    the surrounding write commits. With ``JOBS_RUN_EAGERLY`` it runs in this
+    process after the commit instead.
+    """
+    name = getattr(handler, 'job_name', handler)
+    func, batched, max_attempts = _handlers[name]
+    if settings.JOBS_RUN_EAGERLY:
+        transaction.on_commit(lambda: func([payload]) if batched else func(**payload))
+        return None
+    return Job.objects.create(name=name, payload=payload, max_attempts=max_attempts)
+
+
+def _due(now):
+    # Running jobs whose lease ran out belong to a worker that died
+    return Q(status=Job.PENDING, run_after__lte=now) | Q(status=Job.RUNNING, locked_until__lt=now)
+
+
+def claim(limit):
+    """Claim up to ``limit`` due jobs for this worker, oldest first."""
+    now = timezone.now()
+    token = uuid.uuid4().hex
+    due = list(Job.objects.filter(_due(now)).order_by('run_after', 'id').values_list('id', flat=True)[:limit])
+    if not due:
+        return []
+    # Conditional update, so a job another worker claimed meanwhile is skipped
+    Job.objects.filter(_due(now), id__in=due).update(
+        status=Job.RUNNING,
+        claimed_by=token,
+        locked_until=now + timedelta(seconds=settings.JOBS_LEASE),
+        attempts=F('attempts') + 1
+    )
+    return list(Job.objects.filter(claimed_by=token, status=Job.RUNNING).order_by('id'))
+
+
+def _failed(jobs, error):
+    now = timezone.now()
+    for job in jobs:
+        changes = {'claimed_by': '', 'locked_until': None, 'last_error': error}
+        if job.attempts >= job.max_attempts:
+            changes['status'] = Job.FAILED
+        else:
+            changes['status'] = Job.PENDING
+            changes['run_after'] = now + timedelta(seconds=settings.JOBS_RETRY_DELAY * 2 ** (job.attempts - 1))
+        Job.objects.filter(pk=job.pk, claimed_by=job.claimed_by).update(**changes)
+
+
+def run_jobs(jobs):
+    """
+    Run claimed jobs, batching those of a batched handler into one call.
+    Each call runs in a transaction together with the deletion of its jobs;
+    the jobs of a failed batch are then run one per transaction.
+    Returns ``(done, failed)`` counts; failed jobs are retried later.
+    """
+    by_name = defaultdict(list)
+    for job in jobs:
+        by_name[job.name].append(job)
+
+    done = failed = 0
+    for name, group in by_name.items():
+        if name not in _handlers:
+            logger.error('No handler registered for job %s', name)
+            _failed(group, f'No handler registered for {name}')
+            failed += len(group)
+            continue
+        func, batched, _ = _handlers[name]
+        batches = [group] if batched else [[job] for job in group]
+        while batches:
+            batch = batches.pop(0)
+            try:
+                with transaction.atomic():
+                    if batched:
+                        func([job.payload for job in batch])
+                    else:
+                        func(**batch[0].payload)
+                    Job.objects.filter(id__in=[job.id for job in batch]).delete()
+                done += len(batch)
+            except Exception as e:
+                if len(batch) > 1:
+                    # One bad payload must not fail the others
+                    logger.warning('Batch of %d %s jobs failed (%r); running them one at a time', len(batch), name, e)
+                    batches[:0] = [[job] for job in batch]
+                    continue
+                logger.exception('Job %s failed', name)
+                _failed(batch, repr(e))
+                failed += len(batch)
+    return done, failed
+
+
+def run_pending(limit=None):
+    """Claim and run one round of due jobs. Returns ``(done, failed)`` counts."""
+    return run_jobs(claim(limit or settings.JOBS_BATCH_SIZE))
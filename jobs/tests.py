@@ -0,0 +1,181 @@
+import shutil
+import tempfile
+from datetime import timedelta
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from content.jobs import create_notifications
+from content.models import Lesson, Notification, Resource
+from users.models import CustomUser
+from .models import Job
+from .queue import enqueue, job, run_pending
+
+calls = []
+
+
+@job(name='jobs.tests.record')
+def record(value):
+    calls.append(value)
+
+
+@job(name='jobs.tests.record_batch', batched=True)
+def record_batch(payloads):
+    calls.append([payload['value'] for payload in payloads])
+
+
+@job(name='jobs.tests.explode', max_attempts=2)
+def explode():
+    raise RuntimeError('boom')
+
+
+class JobQueueTests(TestCase):
+    def setUp(self):
+        calls.clear()
+
+    def test_jobs_run_once_and_are_deleted(self):
+        enqueue(record, value=1)
+        enqueue('jobs.tests.record', value=2)
+        self.assertEqual(calls, [])
+        self.assertEqual(run_pending(), (2, 0))
+        self.assertEqual(calls, [1, 2])
+        self.assertFalse(Job.objects.exists())
+        self.assertEqual(run_pending(), (0, 0))
+
+    def test_batched_jobs_run_in_one_call(self):
+        for value in range(3):
+            enqueue(record_batch, value=value)
+        run_pending()
+        self.assertEqual(calls, [[0, 1, 2]])
+
+    def test_failures_are_retried_with_backoff_then_given_up(self):
+        enqueue(explode)
+        with self.assertLogs('jobs.queue', 'ERROR'):
+            self.assertEqual(run_pending(), (0, 1))
+        failed = Job.objects.get()
+        self.assertEqual((failed.status, failed.attempts), (Job.PENDING, 1))
+        self.assertGreater(failed.run_after, timezone.now())
+        self.assertIn('boom', failed.last_error)
+
+        # Not due yet
+        self.assertEqual(run_pending(), (0, 0))
+        Job.objects.update(run_after=timezone.now())
+        with self.assertLogs('jobs.queue', 'ERROR'):
+            run_pending()
+        self.assertEqual(Job.objects.get().status, Job.FAILED)
+
+    def test_jobs_of_a_dead_worker_are_picked_up_again(self):
+        enqueue(record, value=1)
+        Job.objects.update(status=Job.RUNNING, claimed_by='dead', locked_until=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(run_pending(), (1, 0))
+        self.assertEqual(calls, [1])
+
+    @override_settings(JOBS_RUN_EAGERLY=True)
+    def test_eager_mode_runs_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertIsNone(enqueue(record, value=1))
+            self.assertEqual(calls, [])
+        self.assertEqual(calls, [1])
+        self.assertFalse(Job.objects.exists())
+
+
+class BatchFailureTests(TransactionTestCase):
+    def test_a_bad_payload_only_fails_its_own_job(self):
+        users = [CustomUser.objects.create_user(username=f'user{i}', password='password') for i in range(3)]
+        for user in users:
+            enqueue(create_notifications, recipient_id=user.pk, title='Hello', message='...')
+        # Deleted before the worker runs, so its notification breaks the foreign key
+        deleted = users.pop(1).pk
+        CustomUser.objects.filter(pk=deleted).delete()
+        Job.objects.filter(name='content.jobs.delete_user_chat_messages').delete()
+        with self.assertLogs('jobs.queue', 'WARNING'):
+            self.assertEqual(run_pending(), (2, 1))
+
+        self.assertEqual(set(Notification.objects.values_list('recipient_id', flat=True)), {user.pk for user in users})
+        failed = Job.objects.get()
+        self.assertEqual((failed.payload['recipient_id'], failed.status), (deleted, Job.PENDING))
+
+
+class SignalJobTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        self.teacher = CustomUser.objects.create_user(username='teacher', password='password', is_teacher=True)
+        CustomUser.objects.update(is_active=True)
+
+    def test_approval_notifications_are_queued_and_batched(self):
+        lessons = [Lesson.objects.create(title=f'Lesson {i}', content='...', author=self.teacher) for i in range(3)]
+        for lesson in lessons:
+            lesson.is_approved = True
+            lesson.save()
+        self.assertFalse(Notification.objects.exists())
+
+        with self.assertNumQueries(7):
+            # Claim (3), one insert for every notification, delete the jobs, savepoints
+            run_pending()
+        self.assertEqual(Notification.objects.filter(recipient=self.teacher).count(), 3)
+
+    def test_files_are_deleted_by_the_worker(self):
+        with self.settings(MEDIA_ROOT=self.media_root):
+            lesson = Lesson.objects.create(title='Lesson', content='...', author=self.teacher)
+            lesson.pdf_file.save('old.pdf', ContentFile(b'%PDF'))
+            old_name = lesson.pdf_file.name
+            lesson.pdf_file.save('new.pdf', ContentFile(b'%PDF'))
+            self.assertTrue(default_storage.exists(old_name))
+
+            run_pending()
+            self.assertFalse(default_storage.exists(old_name))
+            self.assertTrue(default_storage.exists(lesson.pdf_file.name))
+
+            lesson.delete()
+            run_pending()
+            self.assertFalse(default_storage.exists(lesson.pdf_file.name))
+
+    def test_only_real_approvals_notify(self):
+        lesson = Lesson.objects.create(title='Lesson', content='...', author=self.teacher)
+        lesson = Lesson.objects.get(pk=lesson.pk)
+        lesson.is_approved = True
+        with self.assertNumQueries(3):
+            # The update, the search document and the queued notification; nothing is read back
+            lesson.save()
+        lesson.title = 'Edited'
+        lesson.save()
+
+        client = Client()
+        client.force_login(self.teacher)
+        client.get(reverse('lesson_delete', args=[lesson.pk]))
+        lesson.refresh_from_db()
+        self.assertTrue(lesson.is_removed)
+        run_pending()
+        self.assertEqual(Notification.objects.filter(title='Lesson Approved').count(), 1)
+
+    def test_unchanged_and_deferred_files_are_kept(self):
+        with self.settings(MEDIA_ROOT=self.media_root):
+            resource = Resource.objects.create(title='Sheet', type='pdf', author=self.teacher)
+            resource.file.save('sheet.pdf', ContentFile(b'%PDF'))
+            # The upload's text extraction
+            run_pending()
+            Resource.objects.get(pk=resource.pk).save()
+            deferred = Resource.objects.only('id', 'title').get(pk=resource.pk)
+            deferred.title = 'Renamed'
+            deferred.save(update_fields=['title'])
+            self.assertFalse(Job.objects.exists())
+
+            resource = Resource.objects.get(pk=resource.pk)
+            old_name = resource.file.name
+            resource.file.save('other.pdf', ContentFile(b'%PDF'))
+            run_pending()
+            self.assertFalse(default_storage.exists(old_name))
+
+    def test_replaced_profile_pictures_are_deleted(self):
+        with self.settings(MEDIA_ROOT=self.media_root):
+            self.teacher.profile_pic.save('old.png', ContentFile(b'png'))
+            old_name = self.teacher.profile_pic.name
+            user = CustomUser.objects.get(pk=self.teacher.pk)
+            user.profile_pic.save('new.png', ContentFile(b'png'))
+            run_pending()
+            self.assertFalse(default_storage.exists(old_name))
+            self.assertTrue(default_storage.exists(user.profile_pic.name))
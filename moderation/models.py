@@ -2,6 +2,7 @@ from django.db import models
 from django.conf import settings
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
+from django.utils.functional import cached_property
 from django.utils.translation import gettext_lazy as _
 
 class Report(models.Model):
@@ -52,4 +53,16 @@ class Report(models.Model):
         ordering = ['-created_at']
 
     def __str__(self):
-        return f"Report by {self.reporter} on {self.content_object}"
+        return f"Report by {self.reporter} on {self.target}"
+
+    @cached_property
+    def target(self):
+        """
+        The reported object. Unlike ``content_object`` it is read through the
+        database routers, so reported chat messages resolve when chat has its
+        own database.
+        """
+        model = self.content_type.model_class()
+        if model is None:
+            return None
+        return model._base_manager.filter(pk=self.object_id).first()
@@ -65,7 +65,7 @@ class ModerationActionView(TeacherRequiredMixin, View):
         action = request.POST.get('action')
         note = request.POST.get('note', '')
         
-        target = report.content_object
+        target = report.target
         
         if action == 'dismiss':
             report.status = 'dismissed'
@@ -0,0 +1,19 @@
+# Generated by Django 6.0.1 on 2026-10-17 13:45
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0007_customuser_suspension_end'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='announcements_seen_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -1,6 +1,8 @@
 from django.contrib.auth.models import AbstractUser
 from django.db import models
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
+from core.tracking import TrackedFieldsMixin
 
 YEAR_CHOICES = [
     (1, _('First Year')),
@@ -40,7 +42,9 @@ SUBJECT_CHOICES = [
     ('philosophy', _('Philosophy')),
 ]
 
-class CustomUser(AbstractUser):
+class CustomUser(TrackedFieldsMixin, AbstractUser):
+    tracked_fields = ('profile_pic',)
+
     is_teacher = models.BooleanField(_('Is Teacher'), default=False)
     is_student = models.BooleanField(_('Is Student'), default=False)
     
@@ -54,6 +58,8 @@ class CustomUser(AbstractUser):
     
     # Field to track when the user last cleared their chat history
     last_chat_clear_time = models.DateTimeField(null=True, blank=True)
+    # Announcements are broadcast; the ones created after this are unread
+    announcements_seen_at = models.DateTimeField(default=timezone.now)
     suspension_end = models.DateTimeField(null=True, blank=True)
 
     @property
@@ -1,23 +1,25 @@
+from django.db import transaction
 from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
+from core.versions import bump_version
+from jobs.jobs import delete_files
+from jobs.queue import enqueue
 from .models import CustomUser
 
+@receiver([post_save, post_delete], sender=CustomUser)
+def bump_users_version(sender, using, update_fields=None, **kwargs):
+    # Display names and profile pictures show up on cached pages; logins don't change them
+    if update_fields and set(update_fields) == {'last_login'}:
+        return
+    transaction.on_commit(lambda: bump_version('users'), using=using)
+
 @receiver(post_delete, sender=CustomUser)
 def auto_delete_profile_pic_on_delete(sender, instance, **kwargs):
     if instance.profile_pic:
-        instance.profile_pic.delete(save=False)
+        enqueue(delete_files, name=instance.profile_pic.name)
 
 @receiver(post_save, sender=CustomUser)
 def auto_delete_profile_pic_on_change(sender, instance, **kwargs):
-    if not instance.pk:
-        return False
-
-    try:
-        old_file = CustomUser.objects.get(pk=instance.pk).profile_pic
-    except CustomUser.DoesNotExist:
-        return False
-
-    new_file = instance.profile_pic
-    if not old_file == new_file:
-        if old_file:
-            old_file.delete(save=False)
+    old_file = instance.previous_value('profile_pic')
+    if old_file and instance.has_changed('profile_pic'):
+        enqueue(delete_files, name=old_file)